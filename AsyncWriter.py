@@ -0,0 +1,107 @@
+import threading
+import traceback
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from OutputWriter import OutputWriter
+
+
+class AsyncWriter(OutputWriter):
+    """Runs another writer on a background thread
+
+    The products written for an entry are collected as plain numpy payloads
+    and handed over as one item on save_entry.  A single thread owns the
+    wrapped writer: it opens it, fills and saves the entries in order and
+    finalizes it, so the output is written while the next events are being
+    converted.  The queue holds at most max_pending entries; when it is
+    full save_entry blocks until the writer catches up.
+
+    An error in the writer thread is raised again, with its traceback, by
+    the next call on the converter side.  Arrays handed to the writer must
+    not be modified afterwards.
+    """
+    def __init__(self, writer, max_pending=8):
+        super(AsyncWriter, self).__init__()
+        self._writer = writer
+        self._queue  = queue.Queue(max_pending)
+        self._entry  = []
+        self._error  = None
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _check(self):
+        if self._error is not None:
+            raise Exception("The output writer failed:\n{}".format(self._error))
+
+    def _call(self, method, *args):
+        self._check()
+        self._queue.put((method, args))
+
+    def open(self, file_name):
+        self._call('open', file_name)
+
+    def add_meta(self, name, origin, voxel_size, n_voxels):
+        self._call('add_meta', name, origin, voxel_size, n_voxels)
+
+    def write_particles(self, producer, particles):
+        self._entry.append(('write_particles', (producer, particles)))
+
+    def write_sparse3d(self, producer, meta, index, values):
+        self._entry.append(('write_sparse3d', (producer, meta, index, values)))
+        return len(index)
+
+    def write_cluster3d(self, producer, meta, n_clusters, cluster, index, values):
+        self._entry.append(('write_cluster3d', (producer, meta, n_clusters, cluster, index, values)))
+        return len(index)
+
+    def write_vector(self, producer, key, values):
+        self._entry.append(('write_vector', (producer, key, values)))
+
+    def clear_entry(self):
+        self._entry = []
+
+    def save_entry(self, run, subrun, event):
+        entry, self._entry = self._entry, []
+        self._call('_save', entry, run, subrun, event)
+
+    def finalize(self):
+        self._call('finalize')
+        self.close()
+        self._check()
+
+    def close(self):
+        """Stop the writer thread once it has gone through the queue"""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+            self._writer.close()
+
+    def _save(self, entry, run, subrun, event):
+        for method, args in entry:
+            getattr(self._writer, method)(*args)
+        self._writer.save_entry(run, subrun, event)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+
+            # After a failure, keep draining so the converter never blocks:
+            if self._error is not None:
+                continue
+
+            method, args = item
+            try:
+                if method == '_save':
+                    self._save(*args)
+                else:
+                    getattr(self._writer, method)(*args)
+            except Exception:
+                self._error = traceback.format_exc()
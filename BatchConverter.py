@@ -0,0 +1,321 @@
+import os, sys
+import glob
+import json
+import multiprocessing
+import traceback
+
+from Converter import Converter
+from IOManager import IOManager
+import OutputWriter
+import load_db
+
+
+def expand_inputs(inputs, manifest=None):
+    """Turn a list of files, glob patterns and manifests into a list of files
+
+    Arguments:
+        inputs {list} -- file names or glob patterns
+
+    Keyword Arguments:
+        manifest {str} -- text file with one input (or pattern) per line,
+                          blank lines and lines starting with # are ignored (default: {None})
+
+    Returns:
+        list -- input files, in order, without duplicates
+    """
+    patterns = list(inputs) if inputs is not None else []
+
+    if manifest is not None:
+        with open(manifest) as _manifest:
+            for line in _manifest:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    patterns.append(line)
+
+    files = []
+    seen  = set()
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern))
+        if not matches:
+            # Let missing files through, they are reported as failures:
+            matches = [pattern]
+        for _file in matches:
+            if _file not in seen:
+                seen.add(_file)
+                files.append(_file)
+
+    return files
+
+
+def output_name(_file_in, output_dir=None, output_backend='larcv'):
+    """Output file for an input, optionally placed in another directory"""
+    _file_out = Converter.default_output(_file_in, output_backend)
+    if output_dir is not None:
+        _file_out = os.path.join(output_dir, os.path.basename(_file_out))
+    return _file_out
+
+
+def partial_name(_file_out):
+    """Name used while an output is being written, renamed once complete"""
+    root, ext = os.path.splitext(_file_out)
+    return root + '.partial' + ext
+
+
+# Each worker process owns one converter, so the geometry is built once per worker
+_converter = None
+
+def _initialize_worker(converter_options=None):
+    global _converter
+    _converter = Converter(**(converter_options or {}))
+    _converter.initialize()
+
+
+def _convert_one(task):
+    """Convert a single file in a worker
+
+    A task is (input, output, keyword arguments of Converter.convert).
+
+    Returns:
+        tuple -- (input, output, error), error is None on success
+    """
+    _file_in, _file_out, options = task
+
+    global _converter
+    if _converter is None:
+        _initialize_worker()
+
+    _partial = partial_name(_file_out)
+    try:
+        _converter.convert(_file_in, _partial, **options)
+        os.rename(_partial, _file_out)
+    except Exception:
+        if os.path.exists(_partial):
+            os.remove(_partial)
+        return _file_in, _file_out, traceback.format_exc()
+
+    return _file_in, _file_out, None
+
+
+def _run_tasks(tasks, jobs, collect, converter_options=None):
+    """Run conversion tasks, in this process or in a pool of `jobs` workers"""
+    converter_options = converter_options or {}
+
+    # Resolve the geometry snapshot once, before workers start reading it:
+    if converter_options.get('geometry_snapshot') is not None:
+        load_db.SensorTables(snapshot_file=converter_options['geometry_snapshot'], backend='numpy')
+
+    if jobs <= 1:
+        _initialize_worker(converter_options)
+        collect(_convert_one(task) for task in tasks)
+        return
+
+    pool = multiprocessing.Pool(jobs, initializer=_initialize_worker,
+                                initargs=(converter_options,))
+    try:
+        collect(pool.imap_unordered(_convert_one, tasks))
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def merge_outputs(inputs, _file_out, output_backend='larcv'):
+    """Concatenate output files, keeping the order of inputs and of their entries"""
+    OutputWriter.merge_outputs(inputs, _file_out, output_backend)
+
+
+def shard_ranges(n_entries, n_shards):
+    """Split [0, n_entries) into n_shards contiguous [first, last) ranges"""
+    n_shards = max(1, min(n_shards, n_entries))
+    bounds = [ (n_entries * i) // n_shards for i in range(n_shards + 1) ]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def shard_name(_file_out, entry_range):
+    """Output of the shard covering entries [first, last) of a file"""
+    root, ext = os.path.splitext(_file_out)
+    return "{}_entries{:08d}-{:08d}{}".format(root, entry_range[0], entry_range[1], ext)
+
+
+def shard_manifest_name(_file_out):
+    return _file_out + '.shards.json'
+
+
+class ShardedConverter(object):
+    """Convert a single file as several shards converted in parallel
+
+    The entries of the input are split in contiguous ranges, and each range
+    is converted by a worker into its own output file whose name carries the
+    range.  The shards and their ranges are also listed in a json manifest
+    next to the output, so a single shard can be regenerated on its own.
+    Merging concatenates the shards in entry order, which gives the same
+    event order as a serial conversion.
+    """
+    def __init__(self, n_shards, jobs=None, max_entries=None, converter_options=None,
+                 **io_options):
+        super(ShardedConverter, self).__init__()
+
+        if jobs is None:
+            jobs = min(n_shards, multiprocessing.cpu_count())
+
+        # Keyword arguments of the Converter built in each worker:
+        self._converter_options = converter_options or {}
+
+        self._n_shards    = n_shards
+        self._jobs        = jobs
+        self._max_entries = max_entries
+        self._io_options  = io_options
+
+    def shards(self, _file_in, _file_out):
+        """List the shards of a file as dicts with the shard file and its range"""
+        io = IOManager()
+        if self._io_options.get('cache_index', False):
+            # Save the event index once, before the workers look for it:
+            io.set_file(_file_in, cache_index=True, groups=['PMAPS', 'RECO'])
+            io.pmaps(), io.reco()
+        else:
+            io.set_file(_file_in, groups=[])
+        n_entries = io.num_events()
+        io.close()
+
+        if self._max_entries is not None:
+            n_entries = min(n_entries, self._max_entries)
+
+        return [ {'file' : shard_name(_file_out, r), 'first_entry' : r[0], 'last_entry' : r[1]}
+                 for r in shard_ranges(n_entries, self._n_shards) ]
+
+    def run(self, _file_in, _file_out=None, only=None, merge=False):
+        """Convert the shards of a file
+
+        Arguments:
+            _file_in {str} -- input IC file
+
+        Keyword Arguments:
+            _file_out {str} -- merged output name, shards are named after it (default: {None})
+            only {list} -- numbers of the shards to (re)generate, default all (default: {None})
+            merge {bool} -- merge the shards into _file_out when all are done (default: {False})
+
+        Returns:
+            list -- (shard file, error) of each shard that failed
+        """
+        output_backend = self._converter_options.get('output_backend', 'larcv')
+        if _file_out is None:
+            _file_out = Converter.default_output(_file_in, output_backend)
+
+        shards = self.shards(_file_in, _file_out)
+
+        # There are fewer shards than asked when the file has fewer entries:
+        if only is not None:
+            for i in only:
+                if not 0 <= i < len(shards):
+                    raise Exception("No shard {} of {}, its {} shards are numbered 0 to {}".format(
+                        i, _file_in, len(shards), len(shards) - 1))
+
+        with open(shard_manifest_name(_file_out), 'w') as _manifest:
+            json.dump({'input' : _file_in, 'output' : _file_out, 'shards' : shards},
+                      _manifest, indent=2)
+
+        selected = range(len(shards)) if only is None else only
+        tasks = []
+        for i in selected:
+            options = dict(self._io_options)
+            options['entry_range'] = (shards[i]['first_entry'], shards[i]['last_entry'])
+            tasks.append((_file_in, shards[i]['file'], options))
+
+        failures = []
+        def collect(results):
+            for _, _shard, error in results:
+                if error is None:
+                    sys.stdout.write("Finished shard {}\n".format(_shard))
+                else:
+                    sys.stdout.write("Shard {} FAILED\n{}\n".format(_shard, error))
+                    failures.append((_shard, error))
+
+        _run_tasks(tasks, self._jobs, collect, self._converter_options)
+
+        if merge:
+            missing = [ shard['file'] for shard in shards if not os.path.exists(shard['file']) ]
+            if failures or missing:
+                sys.stdout.write("Not merging, {} shards are missing.\n".format(len(missing)))
+            else:
+                merge_outputs([ shard['file'] for shard in shards ], _file_out, output_backend)
+                sys.stdout.write("Merged {} shards into {}\n".format(len(shards), _file_out))
+
+        return failures
+
+
+class BatchConverter(object):
+    """Convert many IC files, spread over a pool of worker processes
+
+    Outputs are written under a temporary name and only renamed when the
+    conversion finishes, so an existing output always means a completed
+    file.  Those are skipped, which makes a rerun of an interrupted batch
+    pick up where it stopped.  A failing file is reported and does not stop
+    the rest of the batch.
+    """
+    def __init__(self, jobs=None, output_dir=None, max_entries=None, converter_options=None,
+                 **io_options):
+        super(BatchConverter, self).__init__()
+
+        if jobs is None:
+            jobs = multiprocessing.cpu_count()
+
+        # Keyword arguments of the Converter built in each worker:
+        self._converter_options = converter_options or {}
+
+        self._jobs        = jobs
+        self._output_dir  = output_dir
+        self._max_entries = max_entries
+        self._io_options  = io_options
+
+    def tasks(self, files):
+        """Pair each input with its output, leaving out completed files"""
+        tasks = []
+        for _file_in in files:
+            _file_out = output_name(_file_in, self._output_dir,
+                                    self._converter_options.get('output_backend', 'larcv'))
+            if os.path.exists(_file_out):
+                sys.stdout.write("Skipping {}, output {} exists.\n".format(_file_in, _file_out))
+                continue
+            options = dict(self._io_options)
+            options['max_entries'] = self._max_entries
+            tasks.append((_file_in, _file_out, options))
+        return tasks
+
+    def run(self, files):
+        """Convert all files
+
+        Arguments:
+            files {list} -- input files
+
+        Returns:
+            list -- (input, error) of each file that failed
+        """
+        if self._output_dir is not None and not os.path.isdir(self._output_dir):
+            os.makedirs(self._output_dir)
+
+        tasks = self.tasks(files)
+        failures = []
+
+        _run_tasks(tasks, self._jobs,
+                   lambda results : self._collect(results, len(tasks), failures),
+                   self._converter_options)
+
+        sys.stdout.write("Converted {} of {} files, {} failed.\n".format(
+            len(tasks) - len(failures), len(tasks), len(failures)))
+        for _file_in, error in failures:
+            sys.stdout.write("Failed: {}\n{}\n".format(_file_in, error))
+
+        return failures
+
+    def _collect(self, results, n_tasks, failures):
+        done = 0
+        for _file_in, _file_out, error in results:
+            done += 1
+            if error is None:
+                sys.stdout.write("[{}/{}] {} -> {}\n".format(done, n_tasks, _file_in, _file_out))
+            else:
+                sys.stdout.write("[{}/{}] {} FAILED\n".format(done, n_tasks, _file_in))
+                failures.append((_file_in, error))
@@ -0,0 +1,79 @@
+import numpy
+
+
+class BufferPool(object):
+    """Named numpy scratch arrays, reused from one event to the next
+
+    array(name, shape, dtype) returns the first rows of a buffer kept under
+    that name.  A buffer only grows, by at least `growth` times its size,
+    so once the largest events have been seen the event loop stops
+    allocating scratch memory.  The content of a returned array is only
+    valid until the next request of the same name: results that outlive
+    the event (e.g. handed to an output writer) must be copies.
+
+    Keyword Arguments:
+        reuse {bool} -- keep the buffers, otherwise every request allocates (default: {True})
+        growth {float} -- minimum growth factor of a buffer (default: {1.5})
+    """
+    def __init__(self, reuse=True, growth=1.5):
+        super(BufferPool, self).__init__()
+        self._reuse   = reuse
+        self._growth  = growth
+        self._buffers = dict()
+
+    def array(self, name, shape, dtype=numpy.float64):
+        """Scratch array of the given shape, its content is undefined
+
+        Arguments:
+            name {str} -- name of the buffer
+            shape {tuple} -- shape of the array, or its number of rows
+        """
+        if isinstance(shape, (int, numpy.integer)):
+            shape = (shape,)
+        n_rows, row_shape = int(shape[0]), tuple(shape[1:])
+        dtype = numpy.dtype(dtype)
+
+        if not self._reuse:
+            return numpy.empty((n_rows,) + row_shape, dtype=dtype)
+
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.dtype != dtype or buffer.shape[1:] != row_shape:
+            buffer = numpy.empty((n_rows,) + row_shape, dtype=dtype)
+            self._buffers[name] = buffer
+        elif len(buffer) < n_rows:
+            n_rows_new = max(n_rows, int(len(buffer) * self._growth))
+            buffer = numpy.empty((n_rows_new,) + row_shape, dtype=dtype)
+            self._buffers[name] = buffer
+
+        return buffer[:n_rows]
+
+    def astype(self, name, values, dtype):
+        """Copy of values cast to dtype, like values.astype(dtype)"""
+        values = numpy.asarray(values)
+        result = self.array(name, values.shape, dtype)
+        numpy.copyto(result, values, casting='unsafe')
+        return result
+
+    def compress(self, name, condition, values, dtype=None):
+        """Rows of values where condition is True, like values[condition]
+
+        Keyword Arguments:
+            dtype {numpy.dtype} -- cast the rows to this type, through a
+                                   second buffer named name + '/cast'
+                                   (default: {None}, keep the type of values)
+        """
+        values = numpy.asarray(values)
+        shape  = (numpy.count_nonzero(condition),) + values.shape[1:]
+        result = numpy.compress(condition, values, axis=0,
+                                out=self.array(name, shape, values.dtype))
+        if dtype is None or numpy.dtype(dtype) == values.dtype:
+            return result
+        return self.astype(name + '/cast', result, dtype)
+
+    def nbytes(self):
+        """Memory held by the buffers"""
+        return sum(buffer.nbytes for buffer in self._buffers.values())
+
+    def clear(self):
+        """Release all of the buffers"""
+        self._buffers = dict()
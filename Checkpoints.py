@@ -0,0 +1,124 @@
+import os, sys
+import json
+
+import OutputWriter
+
+
+class Checkpoints(object):
+    """Output of a long conversion, sealed in parts every `interval` entries
+
+    Each part is written under a temporary name and renamed once its writer
+    is finalized, so an existing part is always complete.  A small json
+    manifest next to the output lists the sealed parts and the input
+    entries they cover.  A conversion restarted with the same input and
+    output reads the manifest and continues after the last sealed part.
+    The parts can be merged into the output once the input is done.
+
+        out.h5                  merged output, see merge
+        out_part00000.h5        sealed parts
+        out.h5.progress.json    manifest
+    """
+    def __init__(self, _file_in, _file_out, interval):
+        super(Checkpoints, self).__init__()
+        self._file_in  = _file_in
+        self._file_out = _file_out
+        self._interval = interval
+
+        self._parts    = []
+        self._complete = False
+
+        if os.path.exists(self.manifest_file()):
+            with open(self.manifest_file()) as _manifest:
+                manifest = json.load(_manifest)
+            if manifest['input'] == os.path.abspath(_file_in):
+                self._parts    = manifest['parts']
+                self._complete = manifest['complete']
+
+        # Entries added to the part being written:
+        self._first_entry = None
+        self._n_entries   = 0
+        self._n_saved     = 0
+
+    def manifest_file(self):
+        return self._file_out + '.progress.json'
+
+    def part_file(self, number):
+        root, ext = os.path.splitext(self._file_out)
+        return "{}_part{:05d}{}".format(root, number, ext)
+
+    def partial_file(self):
+        """Temporary name of the part being written"""
+        root, ext = os.path.splitext(self.part_file(len(self._parts)))
+        return root + '.partial' + ext
+
+    def files(self):
+        """Sealed parts, in entry order"""
+        return [ part['file'] for part in self._parts ]
+
+    def complete(self):
+        return self._complete
+
+    def next_entry(self):
+        """First input entry not covered by a sealed part"""
+        if not self._parts:
+            return None
+        return self._parts[-1]['stop_entry']
+
+    def add_entry(self, entry, saved):
+        """Count an input entry in the current part
+
+        Returns:
+            bool -- whether the part is full and should be sealed
+        """
+        if self._first_entry is None:
+            self._first_entry = int(entry)
+        self._n_entries += 1
+        if saved:
+            self._n_saved += 1
+        return self._n_entries >= self._interval
+
+    def seal(self, stop_entry):
+        """Rename the finalized current part and record it in the manifest
+
+        A part without any input entry is removed instead.
+
+        Arguments:
+            stop_entry {int} -- input entries before this one are done
+        """
+        if self._n_entries == 0:
+            if os.path.exists(self.partial_file()):
+                os.remove(self.partial_file())
+            return
+
+        part_file = self.part_file(len(self._parts))
+        os.rename(self.partial_file(), part_file)
+        self._parts.append({'file'        : part_file,
+                            'first_entry' : self._first_entry,
+                            'stop_entry'  : int(stop_entry),
+                            'n_saved'     : self._n_saved})
+
+        self._first_entry = None
+        self._n_entries   = 0
+        self._n_saved     = 0
+        self._write_manifest()
+
+    def finish(self):
+        """Record that the whole input has been converted"""
+        self._complete = True
+        self._write_manifest()
+
+    def _write_manifest(self):
+        # Replace the manifest in one step, so it is never seen half written:
+        temporary = self.manifest_file() + '.tmp'
+        with open(temporary, 'w') as _manifest:
+            json.dump({'input'    : os.path.abspath(self._file_in),
+                       'output'   : self._file_out,
+                       'interval' : self._interval,
+                       'complete' : self._complete,
+                       'parts'    : self._parts}, _manifest, indent=2)
+        os.rename(temporary, self.manifest_file())
+
+    def merge(self, output_backend='larcv'):
+        """Merge the sealed parts into the output file"""
+        OutputWriter.merge_outputs(self.files(), self._file_out, output_backend)
+        sys.stdout.write("Merged {} parts into {}\n".format(len(self._parts), self._file_out))
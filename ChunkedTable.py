@@ -0,0 +1,199 @@
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import numpy
+
+
+class _Failure(object):
+    """Exception raised while prefetching, re-raised when the block is used"""
+    def __init__(self, error):
+        super(_Failure, self).__init__()
+        self.error = error
+
+
+_PENDING = object()
+
+
+class Prefetcher(object):
+    """Background thread loading blocks before they are needed
+
+    Blocks are identified by a key.  `request` schedules a load, `fetch`
+    returns the block, waiting for a scheduled load to finish or loading it
+    on the calling thread if it was never requested.  h5py serializes its
+    own calls, so the thread overlaps reads and decompression with the
+    conversion running on the main thread.
+    """
+    def __init__(self):
+        super(Prefetcher, self).__init__()
+        self._requests = queue.Queue()
+        self._lock     = threading.Condition()
+        self._blocks   = dict()
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def request(self, key, loader):
+        with self._lock:
+            if key in self._blocks:
+                return
+            self._blocks[key] = _PENDING
+        self._requests.put((key, loader))
+
+    def fetch(self, key, loader):
+        with self._lock:
+            if key in self._blocks:
+                while self._blocks[key] is _PENDING:
+                    self._lock.wait()
+                block = self._blocks.pop(key)
+            else:
+                block = None
+
+        if block is None:
+            return loader()
+        if isinstance(block, _Failure):
+            raise block.error
+        return block
+
+    def discard(self, key):
+        """Drop a requested block that is not going to be used"""
+        with self._lock:
+            self._blocks.pop(key, None)
+
+    def close(self):
+        self._requests.put(None)
+        self._thread.join()
+        with self._lock:
+            self._blocks.clear()
+
+    def _run(self):
+        while True:
+            item = self._requests.get()
+            if item is None:
+                return
+            key, loader = item
+
+            with self._lock:
+                if key not in self._blocks:
+                    # Discarded before we got to it
+                    continue
+
+            try:
+                block = loader()
+            except Exception as e:
+                block = _Failure(e)
+
+            with self._lock:
+                if key in self._blocks:
+                    self._blocks[key] = block
+                self._lock.notify_all()
+
+
+class ChunkedTable(object):
+    """Block cache in front of an h5py dataset
+
+    Rows are read in blocks of at most `block_bytes`.  When that holds at
+    least one HDF5 chunk of the dataset, a block is a whole number of
+    chunks, so every chunk is read and decompressed once; otherwise blocks
+    are parts of a chunk, which is then decompressed once per block.  Slicing
+    a ChunkedTable returns the same numpy array a slice of the dataset
+    would, served from the cached block.  When a block is first used, the
+    next `read_ahead` blocks are requested from the prefetcher.
+    """
+    def __init__(self, dataset, name, block_bytes, read_ahead=2, prefetcher=None):
+        super(ChunkedTable, self).__init__()
+        self._dataset    = dataset
+        self._name       = name
+        self._n_rows     = len(dataset)
+        self._read_ahead = read_ahead
+        self._prefetcher = prefetcher
+
+        # Align the block size on the HDF5 chunking when a chunk fits, and
+        # never go over block_bytes, short of a single row:
+        chunk_rows = dataset.chunks[0] if dataset.chunks is not None else 1
+        block_rows = max(1, int(block_bytes // max(1, dataset.dtype.itemsize)))
+        if block_rows >= chunk_rows:
+            block_rows -= block_rows % chunk_rows
+        self._block_rows = block_rows
+
+        self._blocks    = dict()
+        self._requested = set()
+
+    def __len__(self):
+        return self._n_rows
+
+    @property
+    def dtype(self):
+        return self._dataset.dtype
+
+    def block_rows(self):
+        return self._block_rows
+
+    def __getitem__(self, key):
+        if isinstance(key, slice) and key.step in (None, 1):
+            start, stop, _ = key.indices(self._n_rows)
+            return self._rows(start, max(start, stop))
+
+        if isinstance(key, (int, numpy.integer)):
+            if key < 0:
+                key += self._n_rows
+            if not 0 <= key < self._n_rows:
+                raise IndexError("Row {} out of range for {}".format(key, self._name))
+            return self._rows(key, key + 1)[0]
+
+        # Field names and fancy indexing go to the dataset itself
+        return self._dataset[key]
+
+    def _rows(self, start, stop):
+        if start == stop:
+            return self._dataset[start:stop]
+
+        first_block = start // self._block_rows
+        last_block  = (stop - 1) // self._block_rows
+
+        pieces = []
+        for block in range(first_block, last_block + 1):
+            data   = self._block(block)
+            offset = block * self._block_rows
+            pieces.append(data[max(start, offset) - offset : min(stop, offset + len(data)) - offset])
+
+        if len(pieces) == 1:
+            return pieces[0]
+        return numpy.concatenate(pieces)
+
+    def _block(self, block):
+        if block in self._blocks:
+            return self._blocks[block]
+
+        # Moving to a new block, only keep the ones ahead of it:
+        for old in list(self._blocks):
+            if old < block or old > block + self._read_ahead:
+                del self._blocks[old]
+        for old in list(self._requested):
+            if old <= block or old > block + self._read_ahead:
+                self._requested.discard(old)
+                if old != block:
+                    self._prefetcher.discard((self._name, old))
+
+        if self._prefetcher is None:
+            data = self._load(block)
+        else:
+            data = self._prefetcher.fetch((self._name, block), self._loader(block))
+            for ahead in range(block + 1, block + self._read_ahead + 1):
+                if ahead * self._block_rows < self._n_rows and ahead not in self._blocks:
+                    self._requested.add(ahead)
+                    self._prefetcher.request((self._name, ahead), self._loader(ahead))
+
+        self._blocks[block] = data
+        return data
+
+    def _loader(self, block):
+        return lambda : self._load(block)
+
+    def _load(self, block):
+        start = block * self._block_rows
+        return self._dataset[start:min(start + self._block_rows, self._n_rows)]
@@ -2,329 +2,408 @@ import os, sys
 import numpy
 
 from IOManager import IOManager
-from larcv import larcv
 import load_db
+import voxelize
+import OutputWriter
+from AsyncWriter import AsyncWriter
+from Checkpoints import Checkpoints
 from ParticleConverter import ParticleConverter
+from SensorTable import SensorTable
+from Instrumentation import Instrumentation
+from Geometry import Geometry, DEFAULT_GRIDS
+from BufferPool import BufferPool
+
+
+# Products the converter can make, the input group each one needs and
+# the per event fields it reads:
+PRODUCTS = ['mc', 'pmaps', 'reco']
+
+PRODUCT_GROUPS = {'mc' : 'MC', 'pmaps' : 'PMAPS', 'reco' : 'RECO'}
+
+PRODUCT_FIELDS = {
+    'mc'    : ['mc_hits', 'mc_particles'],
+    'pmaps' : ['s1', 's2', 's2Pmt', 's2Si'],
+    'reco'  : ['reco_hits'],
+}
+
+# Voxel grid of each product, unless a configured grid lists the product:
+PRODUCT_GRIDS = {'mc' : 'mc', 'pmaps' : 'pmaps', 'reco' : 'pmaps'}
 
 
 class Converter(object):
 
-    def __init__(self):
+    def __init__(self, geometry_snapshot=None, drop_inactive=False, progress_interval=100,
+                 output_backend='larcv', async_write=False, write_queue=8, products=None,
+                 event_filter=None, geometry_config=None, reuse_buffers=True):
         super(Converter, self).__init__()
 
+        # Scratch arrays of the event loop, kept from one event to the next;
+        # arrays handed to the writer are never taken from here:
+        self._buffers = BufferPool(reuse=reuse_buffers)
+
+        # Voxel grids, see Geometry, and the grid each product is voxelized
+        # on.  A configured grid takes the products it lists under a
+        # products key; the default grids are only made for products left
+        # on them:
+        self._geometry_config, self._product_grids = \
+            self._grid_configuration(geometry_config or dict())
+        self._geometry = None
+
+        # Optional EventFilter, applied to the event summary before reading:
+        self._event_filter = event_filter
+
+        # Products to make, any of PRODUCTS; the input groups of the others
+        # are never opened:
+        if products is None:
+            products = PRODUCTS
+        for product in products:
+            if product not in PRODUCTS:
+                raise Exception("Unknown product {}, use some of {}".format(product, PRODUCTS))
+        self._products = [ product for product in PRODUCTS if product in products ]
+
+        # Output format, one of OutputWriter.BACKENDS:
+        self._output_backend = output_backend
+
+        # Write the output on a background thread, with at most write_queue
+        # entries waiting to be written:
+        self._async_write = async_write
+        self._write_queue = write_queue
+
+        # Optional .npz snapshot of the sensor tables, see load_db.SensorTables:
+        self._geometry_snapshot = geometry_snapshot
+
+        # Drop the samples of masked sensors from the PMaps products:
+        self._drop_inactive = drop_inactive
+
+        # Print progress every this many entries (0 to disable):
+        self._progress_interval = progress_interval
+        self._timer = None
+
         # Pointers to the files:
         self._input_file  = None
         self._output_file = None
 
         # IO Instances:
-        self._larcv_io = None
+        self._writer   = None
         self._next_io  = None
 
+        # Checkpoints of the output when it is written in sealed parts:
+        self._checkpoints = None
+
         self._initialized = False
 
         self._pc = ParticleConverter()
 
-    def convert(self, _file_in, _file_out = None, max_entries = None):
+        # Per event products read from the input:
+        self._fields = [ field for product in self._products for field in PRODUCT_FIELDS[product] ]
+
+    @staticmethod
+    def default_output(_file_in, output_backend='larcv'):
+        '''Output name used when none is given: the input with a suffix for the backend'''
+        directory = os.path.dirname(_file_in)
+        file_root = os.path.basename(_file_in)
+        return os.path.join(directory, os.path.splitext(file_root)[0]
+                            + OutputWriter.output_suffix(output_backend) + '.h5')
+
+    @staticmethod
+    def _grid_configuration(geometry_config):
+        '''Split a grid configuration into the Geometry one and the grid of each product'''
+        grids = dict()
+        product_grids = dict(PRODUCT_GRIDS)
+        for name, config in geometry_config.items():
+            config = dict(config)
+            products = config.pop('products', [])
+            if products and config.get('coarsen') is not None:
+                raise Exception("Grid {} is coarsened, its products follow the grid it coarsens".format(name))
+            for product in products:
+                if product not in PRODUCTS:
+                    raise Exception("Unknown product {} for grid {}, use some of {}".format(
+                        product, name, PRODUCTS))
+                product_grids[product] = name
+            grids[name] = config
+
+        for name in set(product_grids.values()):
+            if name not in grids:
+                grids[name] = DEFAULT_GRIDS[name]
+
+        # A grid without products would only add an empty meta to the output:
+        for name, config in grids.items():
+            if config.get('coarsen') is None and name not in product_grids.values():
+                raise Exception("No product is voxelized on grid {}: list some of {} in its "
+                                "products, or coarsen another grid".format(name, PRODUCTS))
+
+        return grids, product_grids
+
+    def initialize(self):
+        '''Build the geometry if that has not been done yet'''
+        if not self._initialized:
+            self.initialize_geometry()
+            self._initialized = True
+
+    def convert(self, _file_in, _file_out = None, max_entries = None, entry_range = None,
+                trace_file = None, checkpoint = None, merge = False, **io_options):
+        '''Convert a file
+
+        With trace_file, the time spent in each stage of every event is
+        written to that file (CSV if it ends in .csv, JSON otherwise).
+
+        With checkpoint, the output is sealed in a new part every checkpoint
+        input entries (see Checkpoints).  Converting the same file again
+        continues after the last sealed part, and with merge the parts are
+        merged into _file_out once the input is done.
+
+        Any extra keyword arguments (cache_index, streaming, read_ahead,
+        memory_budget) are passed on to IOManager.set_file.
+        '''
 
         # if there is not an output file, the output is the input with a new file extension:
         if _file_out is None:
-            directory = os.path.dirname(_file_in)
-            file_root = os.path.basename(_file_in)
-            _file_out = directory + os.path.splitext(file_root)[0] + '_larcv.h5'
-            # print _file_out
+            _file_out = self.default_output(_file_in, self._output_backend)
 
         self._input_file  = _file_in
         self._output_file = _file_out
 
-        if not self._initialized:
-            self.initialize_geometry()
-            self._initialized = True
+        self._checkpoints = None
+        if checkpoint:
+            self._checkpoints = Checkpoints(_file_in, _file_out, checkpoint)
+            if self._checkpoints.complete():
+                sys.stdout.write("{} is already converted.\n".format(_file_in))
+                if merge:
+                    self._checkpoints.merge(self._output_backend)
+                return
+            resume = self._checkpoints.next_entry()
+            if resume is not None:
+                sys.stdout.write("Resuming at entry {}.\n".format(resume))
+                first, last = (None, None) if entry_range is None else entry_range
+                entry_range = (max(resume, first or 0), last)
+
+        self.initialize()
 
         # Create the instances of IO managers:
         self._next_io =  IOManager()
-        self._next_io.set_file(self._input_file)
-
-        # larcv io:
-        self._larcv_io = larcv.IOManager(larcv.IOManager.kWRITE)
-        self._larcv_io.set_out_file(self._output_file)
-        self._larcv_io.initialize()
-
-        self.event_loop(max_entries = max_entries)
+        self._next_io.set_file(self._input_file,
+            groups=[ PRODUCT_GROUPS[product] for product in self._products ], **io_options)
+
+        # Output:
+        if self._checkpoints is None:
+            self._open_writer(self._output_file)
+        else:
+            self._open_writer(self._checkpoints.partial_file())
+
+        try:
+            self.event_loop(max_entries = max_entries, entry_range = entry_range,
+                            trace_file = trace_file)
+        except:
+            self._writer.close()
+            raise
+        finally:
+            self._next_io.close()
+
+        if self._checkpoints is not None and merge:
+            self._checkpoints.merge(self._output_backend)
+
+    def _open_writer(self, file_name):
+        '''Open an output writer on file_name, with the voxel grids declared'''
+        self._writer = OutputWriter.make_writer(self._output_backend)
+        if self._async_write:
+            self._writer = AsyncWriter(self._writer, self._write_queue)
+        self._writer.open(file_name)
+        for grid in self._geometry.grids():
+            self._writer.add_meta(grid.name, grid.origin, grid.voxel_size, grid.n_voxels)
 
     def initialize_geometry(self):
         '''Set up and cache the geometry information
 
-        Creates meta objects for larcv and reads the database for h5.
+        Computes the voxel grids and reads the database for h5.
         '''
 
-        # Read in the database to get the pmt and sipm locations:
-        self._pmt_locations  = load_db.DataPMT()
-        self._sipm_locations = load_db.DataSiPM()
-        self._det_geo        = load_db.DetectorGeo()
-
-        min_x = numpy.min(self._sipm_locations.X)
-        max_x = numpy.max(self._sipm_locations.X)
-        min_y = numpy.min(self._sipm_locations.Y)
-        max_y = numpy.max(self._sipm_locations.Y)
-        min_z = self._det_geo.ZMIN
-        max_z = self._det_geo.ZMAX
-
-        n_x = int(max_x - min_x)
-        n_y = int(max_y - min_y)
-        n_z = int(max_z - min_z)
+        # Read in the database (or its snapshot) to get the pmt and sipm locations.
+        # The numpy backend keeps pandas off the conversion path.
+        self._pmt_locations, self._sipm_locations, self._det_geo = \
+            load_db.SensorTables(snapshot_file=self._geometry_snapshot, backend='numpy')
 
-        # Create just one meta to use for NEXT-New
-        self._mc_meta = larcv.ImageMeta3D()
-        self._mc_meta.set_dimension(0, float(max_x - min_x), n_x, float(min_x))
-        self._mc_meta.set_dimension(1, float(max_y - min_y), n_y, float(min_y))
-        self._mc_meta.set_dimension(2, float(max_z - min_z), n_z, float(min_z))
+        # Dense lookup arrays, indexed by the sensor numbers used in PMaps:
+        self._pmts  = SensorTable(self._pmt_locations)
+        self._sipms = SensorTable(self._sipm_locations)
 
-        # print('_sipm_locations.X', self._sipm_locations.X)
-        # print('_sipm_locations.Y', self._sipm_locations.Y)
-
-        n_x = int(n_x / 10)
-        n_y = int(n_y / 10)
-        n_z = int(n_z / 2 )
-
-
-        self._pmaps_meta = larcv.ImageMeta3D()
-        self._pmaps_meta.set_dimension(0, float(max_x - min_x), n_x, float(min_x))
-        self._pmaps_meta.set_dimension(1, float(max_y - min_y), n_y, float(min_y))
-        self._pmaps_meta.set_dimension(2, float(max_z - min_z), n_z, float(min_z))
+        # The detector spans the SiPM plane in x and y:
+        bounds = numpy.array([[numpy.min(self._sipms.x), numpy.max(self._sipms.x)],
+                              [numpy.min(self._sipms.y), numpy.max(self._sipms.y)],
+                              [float(self._det_geo.ZMIN[0]), float(self._det_geo.ZMAX[0])]])
 
+        self._geometry = Geometry(bounds, self._geometry_config)
 
         return
 
-    def convert_mc_information(self):
+    def convert_mc_information(self, record):
 
 
-        if self._larcv_io is None:
-            raise Exception("No larcv IO manager found.")
+        if self._writer is None:
+            raise Exception("No output writer found.")
 
         if self._next_io is None:
             raise Exception("No next IO manager found.")
 
-        # Convert particle object
-        hits        = self._next_io.mc().hits(self._event)
-        particles   = self._next_io.mc().particles(self._event)
-        larcv_particle_set = larcv.EventParticle.to_particle(
-            self._larcv_io.get_data("particle",  "mcpart"))
-        larcv_voxel3d      = larcv.EventSparseTensor3D.to_sparse_tensor(
-            self._larcv_io.get_data("sparse3d",  "mcpart"))
-        larcv_cluster3d    = larcv.EventSparseCluster3D.to_sparse_cluster(
-            self._larcv_io.get_data("cluster3d", "mcpart"))
-        larcv_particle_set.clear()
-        larcv_voxel3d.clear()
-        larcv_cluster3d.clear()
-
-
-        st = larcv.SparseTensor3D()
-        st.meta(self._mc_meta)
-
-        sc = larcv.SparseCluster3D()
-        sc.meta(self._mc_meta)
-
-        # larcv_voxel3d.meta(self._mc_meta)
-        # larcv_cluster3d.meta(self._mc_meta)
-
-
-        particle_index_mapping = dict()
-        i = 0
-        for particle in particles:
-            larcv_particle = larcv.Particle()
-            larcv_particle.id(i)
-            larcv_particle.track_id(int(particle['particle_indx']))
-            particle_index_mapping[particle['particle_indx']] = i
-            larcv_particle.parent_track_id(int(particle['mother_indx']))
-            larcv_particle.pdg_code(self._pc.get_pdg(particles[i]['particle_name']))
-            larcv_particle.position(
-                float(particle['initial_vertex'][0]), 
-                float(particle['initial_vertex'][1]), 
-                float(particle['initial_vertex'][2]), 
-                float(particle['initial_vertex'][3]))
-            larcv_particle.end_position(
-                float(particle['final_vertex'][0]),
-                float(particle['final_vertex'][1]),
-                float(particle['final_vertex'][2]),
-                float(particle['final_vertex'][3]))
-            # Momentum:
-            larcv_particle.momentum(
-                float(particle['momentum'][0]), 
-                float(particle['momentum'][1]), 
-                float(particle['momentum'][2]))
-            #kinetic energy:
-            larcv_particle.energy_init(float(particle['kin_energy']))
-            larcv_particle.creation_process(str(particle['creator_proc']))
-
-            larcv_particle_set.append(larcv_particle)
-            i += 1;
-            # print particle
-
-        # Create a set of clusters to match the length of the particles:
-        sc.resize(i + 1)
-
-        loc_vector = larcv.VectorOfDouble()
-        loc_vector.resize(3)
-        for hit in hits:
-            xyz = hit['hit_position']
-            loc_vector[0] = float(xyz[0])
-            loc_vector[1] = float(xyz[1])
-            loc_vector[2] = float(xyz[2])
-            index = self._mc_meta.position_to_index(loc_vector)
-            st.emplace(larcv.Voxel(index, float(hit['hit_energy'])))
-            # Get the particle index of this hit:
-            if hit['particle_indx'] in particle_index_mapping.keys():
-                idx = particle_index_mapping[int(hit['particle_indx'])]
-            else:
-                idx = i
-            # larcv_voxel_index = self._mc_meta.id(xyz[0],xyz[1],xyz[2])
-            voxel = larcv.Voxel(index, float(hit['hit_energy']))
-            sc.writeable_voxel_set(idx).add(voxel)
+        # Data files have no MC:
+        if self._next_io.mc() is None:
+            return True
 
-        larcv_voxel3d.emplace(st)
-        larcv_cluster3d.emplace(sc)
+        # Convert particle object
+        hits        = record.mc_hits
+        particles   = record.mc_particles
+
+        i = len(particles)
+        mc_particles = numpy.zeros(i, dtype=OutputWriter.PARTICLE_DTYPE)
+        mc_particles['id']               = numpy.arange(i)
+        mc_particles['track_id']         = particles['particle_indx']
+        mc_particles['parent_track_id']  = particles['mother_indx']
+        mc_particles['pdg_code']         = [ self._pc.get_pdg(name.decode())
+                                             for name in particles['particle_name'] ]
+        mc_particles['position']         = particles['initial_vertex']
+        mc_particles['end_position']     = particles['final_vertex']
+        # Momentum:
+        mc_particles['momentum']         = particles['momentum']
+        #kinetic energy:
+        mc_particles['energy_init']      = particles['kin_energy']
+        mc_particles['creation_process'] = particles['creator_proc']
+
+        self._writer.write_particles("mcpart", mc_particles)
+
+        # Voxelize all of the hits at once, dropping those outside the volume:
+        grid = self._product_grids['mc']
+        index, inside = self._geometry.grid(grid).index(hits['hit_position'], self._buffers)
+        self._timer.count('mc_outside', len(inside) - numpy.count_nonzero(inside))
+        index    = self._buffers.compress('mc/index',  inside, index)
+        energy   = self._buffers.compress('mc/energy', inside, hits['hit_energy'], numpy.float64)
+
+        # Hits from particles not in the particle table go to the last cluster,
+        # so there is one more cluster than particles:
+        cluster = voxelize.map_ids(particles['particle_indx'], numpy.arange(i),
+            self._buffers.compress('mc/particle', inside, hits['particle_indx']), default=i)
+
+        n_voxels = self._write_sparse3d(["mcpart"], grid, *voxelize.sum_duplicates(index, energy))
+
+        cluster, index, energy = voxelize.sum_by_cluster(cluster, index, energy)
+        self._writer.write_cluster3d("mcpart", grid, i + 1, cluster, index, energy)
+        for coarse in self._geometry.derived(grid):
+            self._writer.write_cluster3d("mcpart_" + coarse.name, coarse.name, i + 1,
+                *voxelize.sum_by_cluster(cluster, coarse.coarsen_index(index), energy))
+
+        self._timer.count('mc_hits', len(hits))
+        self._timer.count('mc_voxels', n_voxels)
 
         return True
 
 
-    def convert_pmaps(self):
+    def convert_pmaps(self, record):
 
-        if self._larcv_io is None:
-            raise Exception("No larcv IO manager found.")
+        if self._writer is None:
+            raise Exception("No output writer found.")
 
         if self._next_io is None:
             raise Exception("No next IO manager found.")
 
 
-        pmaps = self._next_io.pmaps()
-        if pmaps is None:
+        if self._next_io.pmaps() is None:
             return True
 
-        larcv_voxel = self._larcv_io.get_data("sparse3d", "pmaps")
-        larcv_voxel.clear()
-        larcv_voxel.meta(self._pmaps_meta)
-
-        larcv_meta = self._larcv_io.get_data("meta", "pmaps")
-
-        # Get the sipms location
-        # _sipm_locations = load_db.DataSiPM()
-
+        s1    = record.s1
+        s2    = record.s2
+        s2Pmt = record.s2Pmt
+        s2Si  = record.s2Si
 
         # Use S1 to get t0
-        if pmaps.s1() is None:
+        if s1 is None:
             return False
-        if pmaps.s2Pmt() is None:
+        if s2Pmt is None:
             return False
-        if pmaps.s2Si() is None:
+        if s2Si is None:
             return False
 
-        s1_peak_time_idx = numpy.argmax(numpy.asarray(pmaps.s1()['ene']))
-        t0 = pmaps.s1()['time'][s1_peak_time_idx]
-        t0 *= 1e-3
+        s1_peak_time_idx = numpy.argmax(numpy.asarray(s1['ene']))
+        t0 = 1e-3 * float(s1['time'][s1_peak_time_idx])
+
+        # The n-th sample of a sensor in a peak happens at the time of
+        # the n-th S2 sample of that peak:
+        sipm_number = self._buffers.astype('pmaps/sipm', s2Si['nsipm'], numpy.int64)
+        sipm_time   = self._s2_sample_times(s2, s2Si['peak'],
+            voxelize.group_rank((s2Si['peak'], sipm_number), self._buffers))
+
+        # Only keep SiPM samples with charge, and place them in the volume:
+        e    = self._buffers.astype('pmaps/energy', s2Si['ene'], numpy.float64)
+        keep = numpy.greater(e, 0.00001, out=self._buffers.array('pmaps/keep', len(e), bool))
+        if self._drop_inactive:
+            keep &= numpy.take(self._sipms.active, sipm_number,
+                               out=self._buffers.array('pmaps/active', len(s2Si), bool))
+
+        kept = self._buffers.compress('pmaps/kept', keep, sipm_number)
+        positions = self._buffers.array('pmaps/positions', (len(kept), 3))
+        numpy.take(self._sipms.x, kept, out=positions[:,0])
+        numpy.take(self._sipms.y, kept, out=positions[:,1])
+        numpy.compress(keep, sipm_time, out=positions[:,2])
+        positions[:,2] *= 1e-3
+        positions[:,2] -= t0
+
+        grid = self._product_grids['pmaps']
+        index, inside = self._geometry.grid(grid).index(positions, self._buffers)
+        self._timer.count('pmaps_outside', len(inside) - numpy.count_nonzero(inside))
+
+        e = self._buffers.compress('pmaps/energy_kept', keep, e)
+        n_voxels = self._write_sparse3d(["pmaps"], grid, *voxelize.sum_duplicates(
+            self._buffers.compress('pmaps/index', inside, index),
+            self._buffers.compress('pmaps/energy_inside', inside, e)))
+
+        self._timer.count('pmaps_voxels', n_voxels)
+
+        # The PMT waveforms are stored as flat time and energy vectors:
+        pmt_time = self._s2_sample_times(s2, s2Pmt['peak'],
+            voxelize.group_rank((s2Pmt['peak'], s2Pmt['npmt']), self._buffers))
+        pmt_energy = s2Pmt['ene']
+        if self._drop_inactive:
+            active = self._pmts.active[s2Pmt['npmt'].astype(numpy.int64)]
+            pmt_time   = pmt_time[active]
+            pmt_energy = pmt_energy[active]
+
+        self._writer.write_vector("pmaps", "s2pmt_time",   pmt_time)
+        self._writer.write_vector("pmaps", "s2pmt_energy", pmt_energy)
 
+        return True
 
-        # Covert the S2 df to a dictionary
-        s2_dict = {}
-
-        for i in xrange(0, len(pmaps.s2())):
-            current_peak = s2_dict.setdefault(pmaps.s2()['peak'][i], ([], []))
-            current_peak[0].append(pmaps.s2()['time'][i])
-            current_peak[1].append(pmaps.s2()['ene'][i])
-
-
-        # print 's2_dict', s2_dict
-
-
-        # Covert the S2Si df to a dictionary
-        # s2si_dict is a dictionary {peak number, sipms dictionary}
-        # 'sipms dictionary' is a dictionary {sipms number, time and energy arrays}
-        s2si_dict = {}
-
-        for i in xrange(0, len(pmaps.s2Si())):
-
-            peak_number = pmaps.s2Si()['peak'][i]
-            sipm_number = pmaps.s2Si()['nsipm'][i]
-
-            current_peak  = s2si_dict.setdefault   (peak_number, {}      )
-            current_sipms = current_peak.setdefault(sipm_number, ([], []))
-
-            # Get the time from previous S2 dictionary, and save time and energy
-            e = pmaps.s2Si()['ene'][i]
-            t = s2_dict[peak_number][0][len(current_sipms[0])]
-            current_sipms[0].append(t)
-            current_sipms[1].append(e)
-
-            x = self._sipm_locations.X[sipm_number]
-            y = self._sipm_locations.Y[sipm_number]
-            z = 1e-3*t - t0
-
-            if e > 0.00001:
-                larcv_voxel.emplace(x, y, z, e)
-
-
-
-        # Covert the S2PMT df to a dictionary
-        # s2pmt_dict is a dictionary {peak number, pmt dictionary}
-        # 'pmt dictionary' is a dictionary {pmt number, time and energy arrays}
-        s2pmt_dict = {}
-
-        times = larcv.VectorOfDouble()
-        energies = larcv.VectorOfDouble()
-
-        for i in xrange(0, len(pmaps.s2Pmt())):
-
-            peak_number = pmaps.s2Pmt()['peak'][i]
-            pmt_number = pmaps.s2Pmt()['npmt'][i]
-
-            current_peak  = s2pmt_dict.setdefault  (peak_number, {}      )
-            current_pmts  = current_peak.setdefault(pmt_number,  ([], []))
+    @staticmethod
+    def _s2_sample_times(s2, peaks, samples):
+        '''Time of the given sample number of each given S2 peak'''
+        if s2 is None:
+            s2 = numpy.zeros(0, dtype=[('peak', 'u1'), ('time', 'f4')])
 
-            # Get the time from previous S2 dictionary, and save time and energy
-            e = pmaps.s2Pmt()['ene'][i]
-            t = s2_dict[peak_number][0][len(current_pmts[0])]
-            current_pmts[0].append(t)
-            current_pmts[1].append(e)
+        # Group the S2 samples by peak, keeping their order within a peak:
+        order = numpy.argsort(s2['peak'], kind='mergesort')
 
-            times.push_back(t)
-            energies.push_back(e)
+        # The samples of peak p are at bounds[p]:bounds[p + 1] in that
+        # order, the peak numbers being small integers:
+        n_peaks = 1 + max(int(numpy.max(peaks))    if len(peaks) else 0,
+                          int(numpy.max(s2['peak'])) if len(s2)  else 0)
+        bounds = numpy.searchsorted(s2['peak'], numpy.arange(n_peaks + 1), sorter=order)
 
-        larcv_meta.store("s2pmt_time", times)
-        larcv_meta.store("s2pmt_energy", energies)
+        first = bounds[:-1][peaks]
+        if numpy.any(samples >= bounds[1:][peaks] - first):
+            raise Exception("Sensor samples don't match the S2 samples of their peak")
 
-        return True
+        return s2['time'][order[first + samples]].astype(numpy.float64)
 
-    def convert_reco(self):
+    def convert_reco(self, record):
 
 
-        if self._larcv_io is None:
-            raise Exception("No larcv IO manager found.")
+        if self._writer is None:
+            raise Exception("No output writer found.")
 
         if self._next_io is None:
             raise Exception("No next IO manager found.")
 
 
-        reco = self._next_io.reco()
-        if reco is None:
+        if self._next_io.reco() is None:
             return True
 
-        hits = reco.hits()
-
-        larcv_voxel_E = larcv.EventSparseTensor3D.to_sparse_tensor(
-            self._larcv_io.get_data("sparse3d", "reco_Q"))
-        larcv_voxel_Q = larcv.EventSparseTensor3D.to_sparse_tensor(
-            self._larcv_io.get_data("sparse3d", "reco_E"))
-        larcv_voxel_E.clear()
-        larcv_voxel_Q.clear()
-
-        st_Q = larcv.SparseTensor3D()
-        st_Q.meta(self._pmaps_meta)
-
-        st_E = larcv.SparseTensor3D()
-        st_E.meta(self._pmaps_meta)
-
-        position_vec = larcv.VectorOfDouble()
-        position_vec.resize(3)
-
+        hits = record.reco_hits
 
         # unique_z = numpy.unique(hits['Z'])
         # min_z = numpy.min(unique_z)
@@ -338,41 +417,86 @@ class Converter(object):
         # print(unique_z / base_step)
 
 
-        print(self._pmaps_meta.dump())
+        positions = self._buffers.array('reco/positions', (len(hits), 3))
+        positions[:,0] = hits['X']
+        positions[:,1] = hits['Y']
+        positions[:,2] = hits['Z']
 
-        for hit in hits:
+        # Hits outside of the volume are dropped:
+        grid = self._product_grids['reco']
+        index, inside = self._geometry.grid(grid).index(positions, self._buffers)
+        self._timer.count('reco_outside', len(inside) - numpy.count_nonzero(inside))
 
-            position_vec[0] = hit['X']
-            position_vec[1] = hit['Y']
-            position_vec[2] = hit['Z']
+        # Q and E are summed per voxel over the same unique voxel index:
+        n_voxels = self._write_sparse3d(["reco_Q", "reco_E"], grid,
+            *voxelize.sum_duplicates(self._buffers.compress('reco/index', inside, index),
+                                     self._buffers.compress('reco/Q', inside, hits['Q']),
+                                     self._buffers.compress('reco/E', inside, hits['E'])))
 
-            index = self._pmaps_meta.position_to_index(position_vec)
+        self._timer.count('reco_hits', len(hits))
+        self._timer.count('reco_voxels', n_voxels)
 
-            st_Q.emplace(larcv.Voxel(index, hit['Q']))
-            st_E.emplace(larcv.Voxel(index, hit['E']))
+        return True
 
-        larcv_voxel_Q.emplace(st_Q)
-        larcv_voxel_E.emplace(st_E)
+    def _write_sparse3d(self, producers, grid, index, *values):
+        '''Write voxels on a grid, and summed on every grid coarsened from it
 
-        return True
+        The voxel indexes must be unique, with one array of values and one
+        producer per product.  On a coarser grid, the name of the grid is
+        appended to the producer.
+
+        Returns:
+            int -- the number of voxels on grid
+        '''
+        n_voxels = 0
+        for producer, value in zip(producers, values):
+            n_voxels = self._writer.write_sparse3d(producer, grid, index, value)
+
+        # Coarser grids sum the voxels of this one, not the points again:
+        for coarse in self._geometry.derived(grid):
+            coarse_voxels = voxelize.sum_duplicates(coarse.coarsen_index(index), *values)
+            for producer, value in zip(producers, coarse_voxels[1:]):
+                self._writer.write_sparse3d(producer + "_" + coarse.name, coarse.name,
+                                            coarse_voxels[0], value)
 
-    def event_loop(self, max_entries=None):
+        return n_voxels
+
+    def event_loop(self, max_entries=None, entry_range=None, trace_file=None):
 
         if not self._initialized:
             raise Exception("Need to initialize before event loop.")
 
-        entry_count = 0
-        for entry in self._next_io.entries():
+        first, last = (None, None) if entry_range is None else entry_range
+
+        self._timer = Instrumentation(self._progress_interval, trace_file)
+        timer = self._timer
+
+        # Only the selected entries are read at all:
+        entries = None
+        if self._event_filter is not None:
+            entries = self._event_filter.select(self._next_io)
+            sys.stdout.write("Selected {} of {} entries.\n".format(
+                len(entries), self._next_io.num_events()))
+
+        records = self._next_io.iter_events(first, last, fields=self._fields, entries=entries)
 
-            if entry_count % 1 == 0:
-                sys.stdout.write("Processed entry {}.\n".format(entry_count))
+        entry_count = 0
+        stop_entry  = None
+        while True:
 
             # Read the entry in the next IO:
-            self._next_io.go_to_entry(entry)
+            timer.start_event()
+            with timer.stage('read'):
+                record = next(records, None)
+            if record is None:
+                timer.abort_event()
+                break
+            timer.count('bytes_read', record.nbytes())
 
+            entry = record.entry
             self._entry = entry
-            self._event = self._next_io.event()
-            self._run = self._next_io.run()
+            self._event = record.event
+            self._run = record.run
 
             if self._run < 0:
                 self._run = 0
@@ -380,21 +504,45 @@ class Converter(object):
             ##########################
             # Do the conversions here.
             ##########################
-            _ok = self.convert_mc_information()
-            _ok = self.convert_pmaps() and _ok
-            _ok = self.convert_reco() and _ok
+            _ok = True
+            if 'mc' in self._products:
+                with timer.stage('mc'):
+                    _ok = self.convert_mc_information(record) and _ok
+            if 'pmaps' in self._products:
+                with timer.stage('pmaps'):
+                    _ok = self.convert_pmaps(record) and _ok
+            if 'reco' in self._products:
+                with timer.stage('reco'):
+                    _ok = self.convert_reco(record) and _ok
 
             # print _ok
 
 
             if _ok:
-                self._larcv_io.set_id(int(self._run), 0, int(self._event))
-                self._larcv_io.save_entry()
+                with timer.stage('save'):
+                    self._writer.save_entry(self._run, 0, self._event)
                 entry_count += 1
+            else:
+                self._writer.clear_entry()
+
+            timer.end_event(entry, self._event, _ok)
+            stop_entry = entry + 1
+
+            # Seal the part once it holds enough entries, and start the next:
+            if self._checkpoints is not None and self._checkpoints.add_entry(entry, _ok):
+                self._writer.finalize()
+                self._checkpoints.seal(stop_entry)
+                self._open_writer(self._checkpoints.partial_file())
 
             if max_entries is not None and entry > max_entries:
                 break
 
-        self._larcv_io.finalize()
+        self._writer.finalize()
+        if self._checkpoints is not None:
+            self._checkpoints.seal(stop_entry)
+            # Stopping at max_entries leaves the rest of the input to a rerun:
+            if record is None:
+                self._checkpoints.finish()
 
         sys.stdout.write("Total number of entries converted: {}\n".format(entry_count))
+        timer.finalize()
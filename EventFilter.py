@@ -0,0 +1,73 @@
+import numpy
+
+
+class EventFilter(object):
+    """Select the entries to convert before any of their data is read
+
+    The cuts are evaluated on the per event summary of the input (see
+    IOManager.event_summary): event number, run number, whether there is
+    an S1, the number of S2 peaks and the total S2 energy.  All given cuts
+    must pass.  Only the selected entries are then read and converted.
+
+    Keyword Arguments:
+        events {list} -- event numbers to keep (default: {None}, all)
+        runs {list} -- run numbers to keep (default: {None}, all)
+        require_s1 {bool} -- keep only events with an S1 (default: {False})
+        min_s2_peaks {int} -- minimum number of S2 peaks (default: {None})
+        max_s2_peaks {int} -- maximum number of S2 peaks (default: {None})
+        s2_energy {tuple} -- (min, max) of the total S2 energy, either may be None (default: {None})
+    """
+    def __init__(self, events=None, runs=None, require_s1=False, min_s2_peaks=None,
+                 max_s2_peaks=None, s2_energy=None):
+        super(EventFilter, self).__init__()
+        self._events       = None if events is None else numpy.asarray(events, dtype=numpy.int64)
+        self._runs         = None if runs   is None else numpy.asarray(runs,   dtype=numpy.int64)
+        self._require_s1   = require_s1
+        self._min_s2_peaks = min_s2_peaks
+        self._max_s2_peaks = max_s2_peaks
+        self._s2_energy    = s2_energy
+
+    @staticmethod
+    def read_event_list(file_name):
+        """Event numbers from a text file, separated by spaces, commas or
+        new lines, with # starting a comment"""
+        events = []
+        with open(file_name) as _file:
+            for line in _file:
+                line = line.split('#')[0].replace(',', ' ')
+                events.extend(int(token) for token in line.split())
+        return numpy.array(events, dtype=numpy.int64)
+
+    def needs_pmaps(self):
+        """Whether the cuts need the PMaps part of the summary"""
+        return self._require_s1 or self._s2_energy is not None or \
+            self._min_s2_peaks is not None or self._max_s2_peaks is not None
+
+    def mask(self, summary):
+        """Boolean mask of the selected rows of an event summary"""
+        keep = numpy.ones(len(summary), dtype=bool)
+
+        if self._events is not None:
+            keep &= numpy.isin(summary['event'], self._events)
+        if self._runs is not None:
+            keep &= numpy.isin(summary['run'], self._runs)
+
+        if self._require_s1:
+            keep &= summary['has_s1']
+        if self._min_s2_peaks is not None:
+            keep &= summary['n_s2_peaks'] >= self._min_s2_peaks
+        if self._max_s2_peaks is not None:
+            keep &= summary['n_s2_peaks'] <= self._max_s2_peaks
+        if self._s2_energy is not None:
+            low, high = self._s2_energy
+            if low is not None:
+                keep &= summary['s2_energy'] >= low
+            if high is not None:
+                keep &= summary['s2_energy'] <= high
+
+        return keep
+
+    def select(self, io):
+        """Entries of the file open in an IOManager that pass the cuts"""
+        summary = io.event_summary(pmaps=self.needs_pmaps())
+        return summary['entry'][self.mask(summary)]
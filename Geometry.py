@@ -0,0 +1,247 @@
+import json
+import numpy
+
+
+# Grids made when no configuration is given: 1 mm voxels over the detector,
+# and 10 mm x 10 mm x 2 mm voxels for the PMaps and RECO products.
+DEFAULT_GRIDS = {
+    'mc'    : {'resolution' : 1.0},
+    'pmaps' : {'resolution' : [10.0, 10.0, 2.0]},
+}
+
+
+class VoxelGrid(object):
+    """A regular 3D voxel grid, with its position to index transform
+
+    The transform is kept as numpy arrays computed once: the bin of a
+    point along each axis is floor(position * scale + offset), and the
+    index of a voxel follows the larcv ImageMeta3D convention,
+    ix + n_x * (iy + n_y * iz).
+
+    A grid made by coarsen groups blocks of voxels of a finer grid, its
+    base: the voxels of the base grid are mapped onto it with
+    coarsen_index, without going back to the points.
+
+    Arguments:
+        name {str} -- name of the grid, used as the meta of its products
+        origin {numpy.ndarray} -- lower edge of the grid in each dimension
+        voxel_size {numpy.ndarray} -- size of a voxel in each dimension
+        n_voxels {numpy.ndarray} -- number of voxels in each dimension
+    """
+    def __init__(self, name, origin, voxel_size, n_voxels):
+        super(VoxelGrid, self).__init__()
+        self.name       = name
+        self.base       = None
+        self.factor     = numpy.ones(3, dtype=numpy.int64)
+        self.origin     = numpy.asarray(origin,     dtype=numpy.float64).reshape(3)
+        self.voxel_size = numpy.asarray(voxel_size, dtype=numpy.float64).reshape(3)
+        self.n_voxels   = numpy.asarray(n_voxels,   dtype=numpy.int64).reshape(3)
+
+        if numpy.any(self.n_voxels < 1) or numpy.any(self.voxel_size <= 0):
+            raise Exception("Grid {} needs at least one voxel of positive size per axis".format(name))
+
+        self._scale   = 1.0 / self.voxel_size
+        self._offset  = -self.origin * self._scale
+        self._strides = numpy.array([1, self.n_voxels[0], self.n_voxels[0] * self.n_voxels[1]],
+                                    dtype=numpy.int64)
+        self._base_n_voxels = self.n_voxels
+
+    def size(self):
+        """Total number of voxels"""
+        return int(numpy.prod(self.n_voxels))
+
+    def upper(self):
+        """Upper edge of the grid in each dimension"""
+        return self.origin + self.voxel_size * self.n_voxels
+
+    def bins(self, positions, buffers=None):
+        """Bin of many points along each axis
+
+        Arguments:
+            positions {numpy.ndarray} -- (N, 3) array of x, y, z
+
+        Keyword Arguments:
+            buffers {BufferPool} -- scratch arrays to reuse (default: {None}, allocate)
+
+        Returns:
+            tuple -- (bins, inside), an (N, 3) int64 array and the boolean
+                     mask of the points inside of the grid; with buffers,
+                     both are only valid until the next call on this grid
+        """
+        positions = numpy.asarray(positions, dtype=numpy.float64).reshape(-1, 3)
+        if buffers is None:
+            bins = numpy.floor(positions * self._scale + self._offset).astype(numpy.int64)
+            inside = numpy.all((bins >= 0) & (bins < self.n_voxels), axis=1)
+            return bins, inside
+
+        n = len(positions)
+        scaled = numpy.multiply(positions, self._scale, out=buffers.array(self.name + '/scaled', (n, 3)))
+        scaled += self._offset
+        numpy.floor(scaled, out=scaled)
+        bins = buffers.array(self.name + '/bins', (n, 3), numpy.int64)
+        numpy.copyto(bins, scaled, casting='unsafe')
+
+        in_range = numpy.greater_equal(bins, 0, out=buffers.array(self.name + '/in_range', (n, 3), bool))
+        in_range &= numpy.less(bins, self.n_voxels, out=buffers.array(self.name + '/below', (n, 3), bool))
+        inside = numpy.logical_and.reduce(in_range, axis=1, out=buffers.array(self.name + '/inside', n, bool))
+        return bins, inside
+
+    def index(self, positions, buffers=None):
+        """Voxel index of many points at once
+
+        Arguments:
+            positions {numpy.ndarray} -- (N, 3) array of x, y, z
+
+        Keyword Arguments:
+            buffers {BufferPool} -- scratch arrays to reuse (default: {None}, allocate)
+
+        Returns:
+            tuple -- (index, inside), index is int64 and only meaningful where
+                     the boolean mask inside is True; with buffers, both are
+                     only valid until the next call on this grid
+        """
+        bins, inside = self.bins(positions, buffers)
+        if buffers is None:
+            return bins.dot(self._strides), inside
+        index = buffers.array(self.name + '/index', len(bins), numpy.int64)
+        return numpy.dot(bins, self._strides, out=index), inside
+
+    def coarsen(self, name, factor):
+        """Grid of blocks of factor voxels of this one along each axis
+
+        The blocks start at the origin; a last, partial block along an axis
+        is a whole voxel of the new grid, which then ends past this one.
+
+        Arguments:
+            name {str} -- name of the new grid
+            factor {int} -- number of voxels per block, one value or one per axis
+
+        Returns:
+            VoxelGrid -- the coarser grid, with the same base as this one
+        """
+        factor = numpy.broadcast_to(numpy.asarray(factor, dtype=numpy.int64), (3,))
+        if numpy.any(factor < 1):
+            raise Exception("Grid {} needs a coarsening factor of at least 1".format(name))
+
+        grid = VoxelGrid(name, self.origin, self.voxel_size * factor, -(-self.n_voxels // factor))
+        if self.base is None:
+            grid.base, grid._base_n_voxels = self.name, self.n_voxels
+        else:
+            grid.base, grid._base_n_voxels = self.base, self._base_n_voxels
+        grid.factor = self.factor * factor
+        return grid
+
+    def coarsen_index(self, index):
+        """Index on this grid of voxel indexes of its base grid"""
+        if self.base is None:
+            raise Exception("Grid {} is not coarsened from another grid".format(self.name))
+        index = numpy.asarray(index, dtype=numpy.int64)
+        n_x, n_y = self._base_n_voxels[0], self._base_n_voxels[1]
+        i_x = (index % n_x) // self.factor[0]
+        i_y = (index // n_x % n_y) // self.factor[1]
+        i_z = (index // (n_x * n_y)) // self.factor[2]
+        return i_x + self.n_voxels[0] * (i_y + self.n_voxels[1] * i_z)
+
+
+class Geometry(object):
+    """Named voxel grids over the detector
+
+    Each grid is configured by a dictionary with:
+
+        resolution   nominal voxel size, one value or one per axis
+        bounds       [[x_min, x_max], [y_min, y_max], [z_min, z_max]]
+                     (default: the detector bounds)
+        padding      added on both sides of the bounds, one value or one
+                     per axis (default: 0)
+
+    The number of voxels along an axis is the padded length divided by the
+    resolution, rounded down, and the voxels are stretched to cover the
+    whole length.
+
+    A grid can instead be derived from another one, with:
+
+        coarsen      name of the finer grid
+        factor       voxels of the finer grid per voxel, one value or one
+                     per axis
+
+    The products on a grid are then also written on every grid derived
+    from it, summing the voxels of the finer grid (see VoxelGrid.coarsen).
+    Which products are voxelized on which grid is up to the Converter.
+
+    Arguments:
+        bounds {numpy.ndarray} -- (3, 2) lower and upper detector bounds
+
+    Keyword Arguments:
+        grids {dict} -- configuration of each grid (default: {None}, DEFAULT_GRIDS)
+    """
+    def __init__(self, bounds, grids=None):
+        super(Geometry, self).__init__()
+        self.bounds = numpy.asarray(bounds, dtype=numpy.float64).reshape(3, 2)
+
+        self._grids = dict()
+        self._names = []
+
+        if grids is None:
+            grids = DEFAULT_GRIDS
+
+        # Derived grids are made once the grid they coarsen exists:
+        pending = sorted(grids)
+        while pending:
+            ready = [ name for name in pending
+                      if grids[name].get('coarsen') is None or grids[name]['coarsen'] in self._grids ]
+            if not ready:
+                raise Exception("Grids {} coarsen grids that are not defined".format(pending))
+            for name in ready:
+                self.add_grid(name, **grids[name])
+                pending.remove(name)
+
+    @staticmethod
+    def read_config(file_name):
+        """Grid configuration from a json file, see Geometry"""
+        with open(file_name) as _file:
+            return json.load(_file)
+
+    def add_grid(self, name, resolution=None, bounds=None, padding=0., coarsen=None, factor=1):
+        """Create a grid from its configuration, see Geometry
+
+        Returns:
+            VoxelGrid -- the new grid
+        """
+        if coarsen is not None:
+            return self._add(self.grid(coarsen).coarsen(name, factor))
+
+        if resolution is None:
+            raise Exception("Grid {} needs a resolution, or a grid to coarsen".format(name))
+        if bounds is None:
+            bounds = self.bounds
+        bounds     = numpy.asarray(bounds,     dtype=numpy.float64).reshape(3, 2)
+        resolution = numpy.broadcast_to(numpy.asarray(resolution, dtype=numpy.float64), (3,))
+        padding    = numpy.broadcast_to(numpy.asarray(padding,    dtype=numpy.float64), (3,))
+
+        lower  = bounds[:,0] - padding
+        length = bounds[:,1] - bounds[:,0] + 2 * padding
+        n_voxels = numpy.maximum(numpy.floor(length / resolution), 1).astype(numpy.int64)
+
+        return self._add(VoxelGrid(name, lower, length / n_voxels, n_voxels))
+
+    def _add(self, grid):
+        name = grid.name
+        if name not in self._grids:
+            self._names.append(name)
+        self._grids[name] = grid
+        return grid
+
+    def grid(self, name):
+        if name not in self._grids:
+            raise Exception("No voxel grid named {}, there are {}".format(name, self._names))
+        return self._grids[name]
+
+    def derived(self, name):
+        """Grids coarsened, directly or not, from the named grid"""
+        return [ grid for grid in self.grids() if grid.base == name ]
+
+    def names(self):
+        return list(self._names)
+
+    def grids(self):
+        return [ self._grids[name] for name in self._names ]
@@ -0,0 +1,239 @@
+import numpy
+import h5py
+
+from OutputWriter import OutputWriter, PARTICLE_DTYPE
+
+
+# Columns of each type of product:
+COLUMNS = {
+    'particle'  : [('particles', PARTICLE_DTYPE)],
+    'sparse3d'  : [('index', numpy.uint64), ('value', numpy.float32)],
+    'cluster3d' : [('cluster', numpy.int32), ('index', numpy.uint64), ('value', numpy.float32)],
+    'vector'    : [('value', numpy.float64)],
+}
+
+EVENT_DTYPE = numpy.dtype([('run', 'i4'), ('subrun', 'i4'), ('event', 'i8')])
+
+
+class _Product(object):
+    """Buffered columns of one product and the number of rows of each entry"""
+    def __init__(self, path, columns, n_entries, attrs):
+        super(_Product, self).__init__()
+        self.path    = path
+        self.columns = columns
+        self.attrs   = attrs
+        self.pending = None
+        self.buffers = dict((name, []) for name, _ in columns)
+        # Entries saved before the product first appeared are empty:
+        self.counts  = [0] * n_entries
+        self.n_rows  = 0
+
+
+class HDF5Writer(OutputWriter):
+    """Writes the products as flat, chunked and compressed HDF5 tables
+
+    Every product is a group holding one dataset per column, with the rows
+    of all entries concatenated, and an `offsets` dataset of length
+    n_entries + 1: the rows of entry i are offsets[i]:offsets[i+1].
+
+        /events                      run, subrun, event of each entry
+        /meta/<name>                 attributes origin, voxel_size, n_voxels
+        /sparse3d/<producer>         index, value, offsets
+        /cluster3d/<producer>        cluster, index, value, offsets
+        /particle/<producer>         particles, offsets
+        /vector/<producer>/<key>     value, offsets
+
+    Voxel products carry the name of their grid in the `meta` attribute.
+    Entries are buffered in memory and appended every flush_entries
+    entries, or sooner once flush_bytes are buffered, so the file sees
+    few, large writes and the buffers stay bounded however large the
+    events.  Nothing here needs larcv.
+    """
+    def __init__(self, flush_entries=1000, chunk_rows=65536, compression='gzip',
+                 compression_opts=4, flush_bytes=64*1024**2):
+        super(HDF5Writer, self).__init__()
+        self._flush_entries    = flush_entries
+        self._flush_bytes      = flush_bytes
+        self._chunk_rows       = chunk_rows
+        self._compression      = compression
+        self._compression_opts = compression_opts
+
+        self._file      = None
+        self._metas     = dict()
+        self._products  = dict()
+        self._events    = []
+        self._n_entries = 0
+        self._buffered  = 0
+
+    def open(self, file_name):
+        self._file = h5py.File(file_name, 'w')
+        self._file.create_group('meta')
+        self._create(self._file, 'events', EVENT_DTYPE)
+
+    def add_meta(self, name, origin, voxel_size, n_voxels):
+        group = self._file['meta'].require_group(name)
+        group.attrs['origin']     = numpy.asarray(origin,     dtype=numpy.float64)
+        group.attrs['voxel_size'] = numpy.asarray(voxel_size, dtype=numpy.float64)
+        group.attrs['n_voxels']   = numpy.asarray(n_voxels,   dtype=numpy.int64)
+        self._metas[name] = group
+
+    def _write(self, kind, path, attrs=None, **columns):
+        product = self._products.get(path)
+        if product is None:
+            product = _Product(path, COLUMNS[kind], self._n_entries, attrs or dict())
+            self._products[path] = product
+        product.pending = dict((name, numpy.asarray(columns[name], dtype=dtype))
+                               for name, dtype in product.columns)
+
+    def write_particles(self, producer, particles):
+        self._write('particle', 'particle/' + producer, particles=particles)
+
+    def write_sparse3d(self, producer, meta, index, values):
+        self._write('sparse3d', 'sparse3d/' + producer, {'meta' : meta},
+                    index=index, value=values)
+        return len(index)
+
+    def write_cluster3d(self, producer, meta, n_clusters, cluster, index, values):
+        self._write('cluster3d', 'cluster3d/' + producer, {'meta' : meta},
+                    cluster=cluster, index=index, value=values)
+        return len(index)
+
+    def write_vector(self, producer, key, values):
+        self._write('vector', 'vector/{}/{}'.format(producer, key), value=values)
+
+    def clear_entry(self):
+        for product in self._products.values():
+            product.pending = None
+
+    def save_entry(self, run, subrun, event):
+        for product in self._products.values():
+            if product.pending is None:
+                product.counts.append(0)
+                continue
+            for name, _ in product.columns:
+                product.buffers[name].append(product.pending[name])
+                self._buffered += product.pending[name].nbytes
+            product.counts.append(len(product.pending[product.columns[0][0]]))
+            product.pending = None
+
+        self._events.append((run, subrun, event))
+        self._n_entries += 1
+
+        if self._n_entries % self._flush_entries == 0 or self._buffered >= self._flush_bytes:
+            self.flush()
+
+    def flush(self):
+        """Append the buffered entries to the file"""
+        if self._events:
+            self._append(self._file['events'], numpy.array(self._events, dtype=EVENT_DTYPE))
+            self._events = []
+
+        for product in self._products.values():
+            if product.path not in self._file:
+                group = self._file.require_group(product.path)
+                for name, value in product.attrs.items():
+                    group.attrs[name] = value
+                for name, dtype in product.columns:
+                    self._create(group, name, dtype)
+                self._create(group, 'offsets', numpy.uint64)
+                self._append(group['offsets'], numpy.zeros(1, dtype=numpy.uint64))
+            group = self._file[product.path]
+
+            for name, _ in product.columns:
+                if product.buffers[name]:
+                    self._append(group[name], numpy.concatenate(product.buffers[name]))
+                product.buffers[name] = []
+
+            offsets = product.n_rows + numpy.cumsum(product.counts, dtype=numpy.uint64)
+            self._append(group['offsets'], offsets)
+            if len(offsets):
+                product.n_rows = int(offsets[-1])
+            product.counts = []
+
+        self._buffered = 0
+
+    def _create(self, group, name, dtype):
+        dtype = numpy.dtype(dtype)
+        chunk_rows = max(1, min(self._chunk_rows, (1024**2) // dtype.itemsize))
+        group.create_dataset(name, shape=(0,), maxshape=(None,), dtype=dtype,
+                             chunks=(chunk_rows,), compression=self._compression,
+                             compression_opts=self._compression_opts)
+
+    @staticmethod
+    def _append(dataset, data):
+        if len(data) == 0:
+            return
+        n = len(dataset)
+        dataset.resize((n + len(data),))
+        dataset[n:] = data
+
+    def finalize(self):
+        self.flush()
+        self._file.attrs['n_entries'] = self._n_entries
+        self._file.close()
+        self._file = None
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def _products(_file):
+    """Paths of the product groups of a file"""
+    paths = []
+    def visit(name, item):
+        if isinstance(item, h5py.Group) and 'offsets' in item:
+            paths.append(name)
+    _file.visititems(visit)
+    return paths
+
+
+def merge_files(inputs, _file_out):
+    """Concatenate files written by HDF5Writer, keeping the order of inputs"""
+    sources = [ h5py.File(_file_in, 'r') for _file_in in inputs ]
+    try:
+        with h5py.File(_file_out, 'w') as out:
+            writer = HDF5Writer()
+            writer._file = out
+
+            out.create_group('meta')
+            for source in sources:
+                for name, group in source['meta'].items():
+                    writer.add_meta(name, group.attrs['origin'], group.attrs['voxel_size'],
+                                    group.attrs['n_voxels'])
+
+            writer._create(out, 'events', EVENT_DTYPE)
+            for source in sources:
+                writer._append(out['events'], source['events'][:])
+
+            paths = []
+            for source in sources:
+                paths += [ path for path in _products(source) if path not in paths ]
+
+            for path in paths:
+                template = next(source[path] for source in sources if path in source)
+                group = out.create_group(path)
+                for name, value in template.attrs.items():
+                    group.attrs[name] = value
+                columns = [ name for name in template if name != 'offsets' ]
+                for name in columns + ['offsets']:
+                    writer._create(group, name, template[name].dtype)
+                writer._append(group['offsets'], numpy.zeros(1, dtype=numpy.uint64))
+
+                n_rows = 0
+                for source in sources:
+                    n_entries = len(source['events'])
+                    if path not in source:
+                        counts = numpy.zeros(n_entries, dtype=numpy.uint64)
+                    else:
+                        counts = numpy.diff(source[path]['offsets'][:])
+                        for name in columns:
+                            writer._append(group[name], source[path][name][:])
+                    writer._append(group['offsets'], n_rows + numpy.cumsum(counts, dtype=numpy.uint64))
+                    n_rows += int(counts.sum())
+
+            out.attrs['n_entries'] = len(out['events'])
+    finally:
+        for source in sources:
+            source.close()
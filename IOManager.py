@@ -4,40 +4,75 @@ import numpy
 
 import h5py
 
+from ChunkedTable import ChunkedTable, Prefetcher
+
+
+# Rows read at a time when scanning whole columns (event indexes, summary):
+INDEX_BLOCK_ROWS = 1048576
+
+
+def _plain_table(dataset):
+    return dataset
+
+
+def _column_blocks(dataset, fields, block_rows=INDEX_BLOCK_ROWS):
+    """Read some columns of a table block_rows rows at a time
+
+    Yields:
+        tuple -- (first row, array of the fields of the block rows), a plain
+                 array for a single field
+    """
+    for start in range(0, len(dataset), block_rows):
+        yield start, dataset[tuple(fields) + (slice(start, start + block_rows),)]
+
 class MCReader(object):
 
-    def __init__(self, mc_group):
+    def __init__(self, mc_group, open_table=_plain_table):
         super(MCReader, self).__init__()
         self._group = mc_group
 
-        # Read the extents:
-        self._extents = self._group['extents']
+        # Read the extents once, they are small and needed for every event:
+        extents = self._group['extents'][()]
 
         # The list of events is in the extents table:
-        self._events    = self._extents['evt_number']
-        self._hits      = self._group['hits']
-        self._particles = self._group['particles']
+        self._events    = numpy.asarray(extents['evt_number'])
+        self._hits      = open_table(self._group['hits'])
+        self._particles = open_table(self._group['particles'])
         self._n_entries = len(self._events)
 
-    def events(self, event):
-        return events
+        # last_hit and last_particle are inclusive, convert them
+        # to [start, stop) ranges for each entry:
+        self._hit_stops       = extents['last_hit'].astype(numpy.int64) + 1
+        self._hit_starts      = numpy.concatenate(([0], self._hit_stops[:-1]))
+        self._particle_stops  = extents['last_particle'].astype(numpy.int64) + 1
+        self._particle_starts = numpy.concatenate(([0], self._particle_stops[:-1]))
+
+        # Sorted event numbers to look entries up, lighter than a dictionary:
+        self._order  = numpy.argsort(self._events, kind='mergesort')
+        self._sorted = self._events[self._order]
+
+    def events(self):
+        return self._events
 
     def entry_from_event(self, event):
-        try:
-            return numpy.where(self._events == event)[0][0]
-        except:
+        position = numpy.searchsorted(self._sorted, event)
+        if position == len(self._sorted) or self._sorted[position] != event:
             raise Exception("Event {} not found in the file".format(event))
+        return int(self._order[position])
 
-    def hits(self, event):
+    def hit_range(self, event):
+        """Get the [start, stop) rows of the hits of an event"""
+        entry = self.entry_from_event(event)
+        return int(self._hit_starts[entry]), int(self._hit_stops[entry])
 
+    def particle_range(self, event):
+        """Get the [start, stop) rows of the particles of an event"""
         entry = self.entry_from_event(event)
+        return int(self._particle_starts[entry]), int(self._particle_stops[entry])
 
-        if entry == 0:
-            min_hit = 0
-        else:
-            min_hit = int(self._extents[entry-1]['last_hit'] + 1)
+    def hits(self, event):
 
-        max_hit = int(self._extents[entry]['last_hit'])
+        min_hit, max_hit = self.hit_range(event)
 
         # Get the slice of hits:
         hits = self._hits[min_hit:max_hit]
@@ -45,156 +80,318 @@ class MCReader(object):
 
     def particles(self,event):
 
-        entry = self.entry_from_event(event)
-
-        if entry == 0:
-            min_particle = 0
-        else:
-            min_particle = int(self._extents[entry-1]['last_particle'] + 1)
-
-        max_particle = int(self._extents[entry]['last_particle'])
+        min_particle, max_particle = self.particle_range(event)
 
-        # Get the slice of hits:
+        # Get the slice of particles:
         particles = self._particles[min_particle:max_particle]
         return particles
 
 
-class PMapsReader(object):
+class EventIndex(object):
+    """Per-event (start, stop) offsets into a table grouped by event number
 
-    def __init__(self, pmaps_group):
-        super(PMapsReader, self).__init__()
-        self._group = pmaps_group
+    IC writes the PMaps and RECO tables with all rows of an event stored
+    contiguously.  Instead of scanning the full event column every time an
+    event is requested, the column is read once and reduced to its run-length
+    boundaries.  Looking up an event is then a binary search returning a
+    slice that can be applied directly to the h5py dataset.
+    """
+    def __init__(self, events, starts, stops):
+        super(EventIndex, self).__init__()
+        self._events = numpy.asarray(events)
+        self._starts = numpy.asarray(starts, dtype=numpy.int64)
+        self._stops  = numpy.asarray(stops,  dtype=numpy.int64)
 
-        self._s1    = self._group['S1']
-        self._s1Pmt = self._group['S1Pmt']
-        self._s2    = self._group['S2']
-        self._s2Pmt = self._group['S2Pmt']
-        self._s2Si  = self._group['S2Si']
-        self._event = None
-        self._current_indexes_s1 = None
-        self._current_indexes_s1pmt = None
-        self._current_indexes_s2 = None
-        self._current_indexes_s2si = None
-        self._current_indexes_s2pmt = None
+        # Sorted event numbers for the lookups; unlike a dictionary this
+        # stays a few bytes per event:
+        self._order  = numpy.argsort(self._events, kind='mergesort')
+        self._sorted = self._events[self._order]
 
-    def set_event(self, evt_no=0):
+    @classmethod
+    def from_column(cls, column, name="table"):
+        """Build the index from the event column of a table
 
-        self._event = evt_no
+        The column only has to be contiguous per event, not sorted.  This is
+        also the (single) place where that contiguity is validated.
 
-        # Make a slice of the s1, s1pmt, s2, s2si, s2pmt objects:
-        self._current_indexes_s1 = numpy.where(self._s1['event'] == self._event)[0]
-        self._current_indexes_s1pmt = numpy.where(self._s1Pmt['event'] == self._event)[0]
-        self._current_indexes_s2 = numpy.where(self._s2['event'] == self._event)[0]
-        self._current_indexes_s2si = numpy.where(self._s2Si['event'] == self._event)[0]
-        self._current_indexes_s2pmt = numpy.where(self._s2Pmt['event'] == self._event)[0]
+        Arguments:
+            column {numpy.ndarray} -- event number of every row in the table
 
+        Keyword Arguments:
+            name {str} -- table name, used in error messages (default: {"table"})
 
-    def s1(self, event=None):
+        Returns:
+            EventIndex
+        """
+        column = numpy.asarray(column)
+        return cls._from_blocks([(0, column)], len(column), name)
 
-        if event is None:
-            event = self._event
+    @classmethod
+    def from_dataset(cls, dataset, name="table", block_rows=INDEX_BLOCK_ROWS):
+        """Build the index from the event column of a table on file
 
-        if len(self._current_indexes_s1) == 0:
-            return None
+        Same as from_column, reading the column block_rows at a time so
+        only one block and the per event offsets are ever in memory.
+        """
+        return cls._from_blocks(_column_blocks(dataset, ['event'], block_rows),
+                                len(dataset), name)
+
+    @classmethod
+    def _from_blocks(cls, blocks, n_rows, name):
+        starts = []
+        events = []
+        previous = None
+        for offset, column in blocks:
+            if len(column) == 0:
+                continue
+
+            # Run-length boundaries of the event column, across blocks too:
+            new_run = numpy.ones(len(column), dtype=bool)
+            new_run[1:] = column[1:] != column[:-1]
+            if previous is not None:
+                new_run[0] = column[0] != previous
+            previous = column[-1]
+
+            positions = numpy.flatnonzero(new_run)
+            starts.append(offset + positions)
+            events.append(column[positions])
+
+        if not starts:
+            empty = numpy.zeros(0, dtype=numpy.int64)
+            return cls(empty, empty, empty)
+
+        starts = numpy.concatenate(starts)
+        events = numpy.concatenate(events)
+        stops  = numpy.concatenate((starts[1:], [n_rows]))
+
+        # Contiguity check: every event must appear in exactly one run
+        if len(numpy.unique(events)) != len(events):
+            raise Exception("Rows of {} are not contiguous in event number".format(name))
+
+        return cls(events, starts, stops)
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix):
+        """Restore an index saved with `to_arrays`"""
+        return cls(arrays[prefix + '/events'],
+                   arrays[prefix + '/starts'],
+                   arrays[prefix + '/stops'])
+
+    def to_arrays(self, prefix):
+        """Flatten the index into a dict of arrays suitable for numpy.savez"""
+        return {
+            prefix + '/events' : self._events,
+            prefix + '/starts' : self._starts,
+            prefix + '/stops'  : self._stops,
+        }
+
+    def events(self):
+        return self._events
+
+    def range(self, event):
+        """Get the (start, stop) rows of an event, (0, 0) if not present"""
+        position = numpy.searchsorted(self._sorted, event)
+        if position == len(self._sorted) or self._sorted[position] != event:
+            return (0, 0)
+        row = self._order[position]
+        return int(self._starts[row]), int(self._stops[row])
+
+    def ranges(self, events):
+        """Vectorized range: (starts, stops) arrays, 0 for absent events"""
+        events = numpy.asarray(events)
+        starts = numpy.zeros(len(events), dtype=numpy.int64)
+        stops  = numpy.zeros(len(events), dtype=numpy.int64)
+        if len(self._events) == 0:
+            return starts, stops
+
+        order    = self._order
+        position = numpy.clip(numpy.searchsorted(self._sorted, events), 0, len(order) - 1)
+        found    = self._sorted[position] == events
+
+        starts[found] = self._starts[order[position[found]]]
+        stops[found]  = self._stops[order[position[found]]]
+        return starts, stops
+
+
+def event_indexes(group, table_names, cache=None, prefix=''):
+    """Build (or fetch from `cache`) the EventIndex of each table in a group
+
+    Arguments:
+        group {h5py.Group} -- group holding the tables
+        table_names {list} -- names of the tables to index
+
+    Keyword Arguments:
+        cache {dict} -- previously saved index arrays (default: {None})
+        prefix {str} -- prefix of the table names in the cache (default: {''})
+
+    Returns:
+        dict -- table name to EventIndex
+    """
+    indexes = dict()
+    for name in table_names:
+        key = prefix + name
+        if cache is not None and key + '/events' in cache:
+            indexes[name] = EventIndex.from_arrays(cache, key)
         else:
-            min_index = numpy.min(self._current_indexes_s1)
-            max_index = numpy.max(self._current_indexes_s1) + 1
-            # This is a basic contiguiousness check (sp?  how do you spell that?)
-            assert len(self._current_indexes_s1) == max_index - min_index
-            return self._s1[min_index:max_index]
+            indexes[name] = EventIndex.from_dataset(group[name], key)
+    return indexes
 
 
-    def s1Pmt(self, event=None):
+class PMapsReader(object):
 
-        if event is None:
-            event = self._event
+    _tables = ['S1', 'S1Pmt', 'S2', 'S2Pmt', 'S2Si']
 
-        if len(self._current_indexes_s1pmt) == 0:
-            return None
-        else:
-            min_index = numpy.min(self._current_indexes_s1pmt)
-            max_index = numpy.max(self._current_indexes_s1pmt) + 1
-            # This is a basic contiguiousness check (sp?  how do you spell that?)
-            assert len(self._current_indexes_s1pmt) == max_index - min_index
-            return self._s1Pmt[min_index:max_index]
+    def __init__(self, pmaps_group, indexes=None, open_table=_plain_table):
+        super(PMapsReader, self).__init__()
+        self._group = pmaps_group
 
-    def s2(self, event=None):
+        self._s1    = open_table(self._group['S1'])
+        self._s1Pmt = open_table(self._group['S1Pmt'])
+        self._s2    = open_table(self._group['S2'])
+        self._s2Pmt = open_table(self._group['S2Pmt'])
+        self._s2Si  = open_table(self._group['S2Si'])
+        self._event = None
 
-        if event is None:
-            event = self._event
+        if indexes is None:
+            indexes = event_indexes(self._group, self._tables)
+        self._indexes = indexes
 
-        if len(self._current_indexes_s2) == 0:
-            return None
-        else:
-            min_index = numpy.min(self._current_indexes_s2)
-            max_index = numpy.max(self._current_indexes_s2) + 1
-            # continuity assertion:
-            assert len(self._current_indexes_s2) == max_index - min_index
-            return self._s2[min_index:max_index]
+        self._current_range_s1    = (0, 0)
+        self._current_range_s1pmt = (0, 0)
+        self._current_range_s2    = (0, 0)
+        self._current_range_s2si  = (0, 0)
+        self._current_range_s2pmt = (0, 0)
 
+    def indexes(self):
+        return self._indexes
 
-    def s2Pmt(self, event=None):
+    def set_event(self, evt_no=0):
 
-        if event is None:
-            event = self._event
+        self._event = evt_no
 
-        if len(self._current_indexes_s2pmt) == 0:
-            return None
-        else:
-            min_index = numpy.min(self._current_indexes_s2pmt)
-            max_index = numpy.max(self._current_indexes_s2pmt) + 1
-            # continuity assertion:
-            assert len(self._current_indexes_s2pmt) == max_index - min_index
-            return self._s2Pmt[min_index:max_index]
+        # Look up the slice of the s1, s1pmt, s2, s2si, s2pmt objects:
+        self._current_range_s1    = self._indexes['S1'].range(self._event)
+        self._current_range_s1pmt = self._indexes['S1Pmt'].range(self._event)
+        self._current_range_s2    = self._indexes['S2'].range(self._event)
+        self._current_range_s2si  = self._indexes['S2Si'].range(self._event)
+        self._current_range_s2pmt = self._indexes['S2Pmt'].range(self._event)
 
-    def s2Si(self, event=None):
+    def _slice(self, table, name, current_range, event):
 
-        if event is None:
-            event = self._event
+        if event is None or event == self._event:
+            min_index, max_index = current_range
+        else:
+            min_index, max_index = self._indexes[name].range(event)
 
-        if len(self._current_indexes_s2si) == 0:
+        if max_index == min_index:
             return None
-        else:
-            min_index = numpy.min(self._current_indexes_s2si)
-            max_index = numpy.max(self._current_indexes_s2si) + 1
-            # continuity assertion:
-            assert len(self._current_indexes_s2si) == max_index - min_index
-            return self._s2Si[min_index:max_index]
+        return table[min_index:max_index]
 
-class RecoReader(object):
+    def s1(self, event=None):
+        return self._slice(self._s1, 'S1', self._current_range_s1, event)
 
+    def s1Pmt(self, event=None):
+        return self._slice(self._s1Pmt, 'S1Pmt', self._current_range_s1pmt, event)
+
+    def s2(self, event=None):
+        return self._slice(self._s2, 'S2', self._current_range_s2, event)
+
+    def s2Pmt(self, event=None):
+        return self._slice(self._s2Pmt, 'S2Pmt', self._current_range_s2pmt, event)
+
+    def s2Si(self, event=None):
+        return self._slice(self._s2Si, 'S2Si', self._current_range_s2si, event)
+
+class RecoReader(object):
 
+    _tables = ['Events']
 
-    def __init__(self, mc_group):
+    def __init__(self, mc_group, indexes=None, open_table=_plain_table):
         super(RecoReader, self).__init__()
         self._group = mc_group
 
         # Read the extents:
-        self._events = self._group['Events']
+        self._events = open_table(self._group['Events'])
         self._event  = None
 
+        if indexes is None:
+            indexes = event_indexes(self._group, self._tables)
+        self._indexes = indexes
+
+        self._current_reco_range = (0, 0)
+
+    def indexes(self):
+        return self._indexes
 
     def hits(self, event=None):
-        min_index = numpy.min(self._current_reco_indexes)
-        max_index = numpy.max(self._current_reco_indexes) + 1
-        assert len(self._current_reco_indexes) == max_index - min_index
+        if event is None or event == self._event:
+            min_index, max_index = self._current_reco_range
+        else:
+            min_index, max_index = self._indexes['Events'].range(event)
         return self._events[min_index:max_index]
 
     def set_event(self, evt_no=0):
 
         self._event = evt_no
 
-        # Make a slice of the s1, s1pmt, s2, s2si, s2pmt objects:
-        self._current_reco_indexes = numpy.where(self._events['event'] == self._event)[0]
+        # Look up the slice of the reco hits:
+        self._current_reco_range = self._indexes['Events'].range(self._event)
+
 
 
+class EventRecord(object):
+    """The data of one event, as yielded by IOManager.iter_events
+
+    Products that were not requested, or are not in the file, are None.
+    The PMaps tables of an event without that table are also None, and
+    MC and RECO products are (possibly empty) arrays.
+    """
+    __slots__ = ('entry', 'event', 'run', 'timestamp') + \
+        ('mc_hits', 'mc_particles', 's1', 's1Pmt', 's2', 's2Pmt', 's2Si', 'reco_hits')
+
+    def __init__(self, entry, event, run, timestamp):
+        self.entry     = entry
+        self.event     = event
+        self.run       = run
+        self.timestamp = timestamp
+        for field in FIELDS:
+            setattr(self, field, None)
+
+    def nbytes(self):
+        """Size of the products read for this event"""
+        return sum(getattr(self, field).nbytes for field in FIELDS
+                   if getattr(self, field) is not None)
+
+
+# Per event summary used to select events, see IOManager.event_summary:
+SUMMARY_DTYPE = numpy.dtype([('entry', 'i8'), ('event', 'i8'), ('run', 'i8'),
+                             ('has_s1', '?'), ('n_s2_peaks', 'i4'), ('s2_energy', 'f8')])
+
+# Groups of the file that have a reader:
+GROUPS = ['MC', 'PMAPS', 'RECO']
+
+# Products available per event, and the group they are read from:
+FIELDS = dict(
+    mc_hits      = 'MC',
+    mc_particles = 'MC',
+    s1           = 'PMAPS',
+    s1Pmt        = 'PMAPS',
+    s2           = 'PMAPS',
+    s2Pmt        = 'PMAPS',
+    s2Si         = 'PMAPS',
+    reco_hits    = 'RECO',
+)
+
 
 class IOManager(object):
     """wrapper to IC event interface to allow random access through events
 
     IC doesn't implicitly allow a random access event loop.  This class
-    reads an entire file into memory, and then stores the events to allow
-    the event viewer to access them randomly.
+    indexes the rows of every event in the tables of a file, and then reads
+    the events on demand to allow the event viewer to access them randomly.
+    Only per event offsets are held in memory: the event columns are read
+    in blocks of INDEX_BLOCK_ROWS rows to build them, and the tables
+    themselves are read per event, or in bounded blocks in streaming mode.
     """
     def __init__(self):
         super(IOManager, self).__init__()
@@ -203,18 +400,21 @@ class IOManager(object):
         # Current entry in the above list
         self._current_entry = 0
         self._file   = None
-        self._mc     = None
-        self._pmaps  = None
-        self._reco   = None
         self._events = None
 
+        # Readers of the selected groups, opened on first use:
+        self._groups  = []
+        self._readers = dict()
+
+        self._prefetcher = None
+
     def event(self):
         """Get the data from the current event
 
         Returns:
             [type] -- [description]
         """
-        return self._events['evt_number'][self._current_entry]
+        return self._events[self._current_entry]['evt_number']
 
     def entry(self):
         """Get the currently accessed entry
@@ -225,7 +425,8 @@ class IOManager(object):
         return self._current_entry
 
     def entries(self):
-        return self._entries
+        """All of the entries of the file, made on request"""
+        return numpy.arange(0, self._max_entry)
 
     def run(self):
         """Get the run number of the current entry
@@ -233,7 +434,7 @@ class IOManager(object):
         Returns:
             int -- the current run number
         """
-        return self._runs['run_number'][self._current_entry]
+        return self._runs[self._current_entry]['run_number']
 
     def timestamp(self):
         """Get the timestamp for the current entry
@@ -241,45 +442,163 @@ class IOManager(object):
         Returns:
             timestamp
         """
-        return self._events['timestamp'][self._current_entry]
+        return self._events[self._current_entry]['timestamp']
 
 
-    def set_file(self, file_name):
+    def set_file(self, file_name, cache_index=False, streaming=False,
+                 read_ahead=2, memory_budget=256*1024**2, groups=None):
         """Open a new file and read it's data
 
-        Read the pmaps from a new file.  Will attempt to read MC as well, though
-        it will catch exceptions if any MC is missing.
-
-        Does not yet read reconstructed information, this is a TODO
+        Only the groups listed in `groups` (MC, PMAPS, RECO) are read, and
+        each of them only when it is first used: its reader is opened, and
+        its per event offsets computed, the first time the group is accessed.
+        Groups missing from the file are skipped, their accessors return None.
+        With cache_index, the offsets are also saved to (and on later calls
+        loaded from) a sidecar file next to the input, see `index_file`.
+
+        In streaming mode, the tables are read in large blocks, and a
+        background thread reads the next read_ahead blocks of every table
+        while the current one is used.  The budget is split evenly between
+        the blocks of all tables, which are aligned on the HDF5 chunks when
+        their share holds a whole chunk and are smaller otherwise, see
+        ChunkedTable.  Rows handed out across two blocks and the HDF5 chunk
+        cache of h5py are not counted in memory_budget.
 
         Arguments:
             file_name {str} -- path to file to open
+
+        Keyword Arguments:
+            cache_index {bool} -- persist the event index next to the file (default: {False})
+            streaming {bool} -- read blocks of events ahead of time (default: {False})
+            read_ahead {int} -- number of blocks read ahead in streaming mode (default: {2})
+            memory_budget {int} -- bytes of blocks held in streaming mode (default: {256 MB})
+            groups {list} -- groups to read, see GROUPS (default: {None}, all)
         """
 
+        self.close()
         self._file = h5py.File(file_name, 'r')
 
+        if groups is None:
+            groups = GROUPS
+        for group in groups:
+            if group not in GROUPS:
+                raise Exception("Unknown group {}, use some of {}".format(group, GROUPS))
+        self._groups  = [ group for group in groups if group in self._file ]
+        self._readers = dict()
+
+        open_table = _plain_table
+        if streaming:
+            open_table = self._streaming_tables(read_ahead, memory_budget)
+        self._open_table = open_table
 
-        self._runs = self._file['Run']['runInfo']
-        self._events = self._file['Run']['events']
+
+        self._runs = open_table(self._file['Run']['runInfo'])
+        self._events = open_table(self._file['Run']['events'])
 
         self._current_entry = 0
         self._max_entry = len(self._events)
-        self._entries = numpy.arange(0, self._max_entry)
 
+        self._file_name   = file_name
+        self._cache_index = cache_index
+        self._index_cache = self._load_index(file_name) if cache_index else None
 
+        print("OK")
 
-        self._mc = MCReader(self._file['MC'])
-        if 'PMAPS' in self._file.keys():
-            self._pmaps = PMapsReader(self._file['PMAPS'])
-        else:
-            self._pmaps = None
+    def _reader(self, group):
+        """Reader of a group, opened on first use, None if not selected or absent"""
+        if group not in self._groups:
+            return None
+        if group not in self._readers:
+            self._open_reader(group)
+        return self._readers[group]
+
+    def _open_reader(self, group):
+        if group == 'MC':
+            self._readers[group] = MCReader(self._file['MC'], self._open_table)
+            return
+
+        reader_class = PMapsReader if group == 'PMAPS' else RecoReader
+        cache = self._index_cache
+        cached = cache is not None and all(
+            '{}/{}/events'.format(group, name) in cache for name in reader_class._tables)
+
+        self._readers[group] = reader_class(self._file[group],
+            event_indexes(self._file[group], reader_class._tables, cache, group + '/'),
+            self._open_table)
+
+        if self._cache_index and not cached:
+            self._save_index(self._file_name)
+
+    def _streaming_tables(self, read_ahead, memory_budget):
+        """Make the function wrapping each dataset in a ChunkedTable"""
+        self._prefetcher = Prefetcher() if read_ahead > 0 else None
+
+        # Split the budget between the tables of the file and the blocks of each table:
+        n_tables = len(list(self._iter_datasets()))
+        block_bytes = memory_budget // max(1, n_tables * (read_ahead + 1))
+
+        def open_table(dataset):
+            return ChunkedTable(dataset, dataset.name, block_bytes, read_ahead, self._prefetcher)
+        return open_table
+
+    def _iter_datasets(self):
+        """Tables read per event: run info, and those of the selected groups"""
+        for group, names in [('Run', ['runInfo', 'events']),
+                             ('MC', ['hits', 'particles']),
+                             ('PMAPS', PMapsReader._tables),
+                             ('RECO', RecoReader._tables)]:
+            if group in self._file and (group == 'Run' or group in self._groups):
+                for name in names:
+                    if name in self._file[group]:
+                        yield self._file[group][name]
+
+    @staticmethod
+    def index_file(file_name):
+        """Name of the sidecar file holding the event index of `file_name`"""
+        return file_name + '.index.npz'
+
+    def _load_index(self, file_name):
+        """Load the saved event index, or None if missing or out of date"""
+        index_file = self.index_file(file_name)
+        if not os.path.exists(index_file):
+            return None
 
-        if 'RECO' in self._file.keys():
-            self._reco = RecoReader(self._file['RECO'])
-        else:
-            self._reco = None
+        stat = os.stat(file_name)
+        with numpy.load(index_file) as saved:
+            if int(saved['source_size']) != stat.st_size or \
+               float(saved['source_mtime']) != stat.st_mtime:
+                return None
+            return dict((key, saved[key]) for key in saved.files)
 
-        print("OK")
+    def _save_index(self, file_name):
+        """Write the event index of the open file to its sidecar file
+
+        Indexes saved earlier for groups that are not open are kept.
+        """
+        stat = os.stat(file_name)
+        arrays = dict(self._index_cache or {})
+        arrays['source_size']  = numpy.int64(stat.st_size)
+        arrays['source_mtime'] = numpy.float64(stat.st_mtime)
+        for group, reader in self._readers.items():
+            if group != 'MC':
+                for name, index in reader.indexes().items():
+                    arrays.update(index.to_arrays(group + '/' + name))
+        self._index_cache = arrays
+
+        try:
+            numpy.savez(self.index_file(file_name), **arrays)
+        except (IOError, OSError):
+            print("Could not save event index for {}".format(file_name))
+
+    def close(self):
+        """Close the currently open file, if any"""
+        if self._prefetcher is not None:
+            self._prefetcher.close()
+            self._prefetcher = None
+        self._readers = dict()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
 
     def pmaps(self):
         """Return the pmap object for selected entry
@@ -294,7 +613,7 @@ class IOManager(object):
             PMap - evm.Pmap object
         """
 
-        return self._pmaps
+        return self._reader('PMAPS')
 
 
     def mc(self):
@@ -311,12 +630,12 @@ class IOManager(object):
         """
 
 
-        return self._mc
+        return self._reader('MC')
 
 
     def reco(self):
 
-        return self._reco
+        return self._reader('RECO')
 
     def num_events(self):
         """Query for the total number of events in this file
@@ -326,6 +645,125 @@ class IOManager(object):
         """
         return self._max_entry
 
+    def event_summary(self, pmaps=True):
+        """Cheap per event quantities, to select events without reading them
+
+        Event and run numbers come from the Run tables.  With pmaps, and if
+        the file has PMAPS, the S1 and S2 tables give whether each event has
+        an S1, its number of S2 peaks and its total S2 energy; only the
+        event, peak and ene columns of S2 are read, and the event indexes
+        are shared with the PMAPS reader and the index cache.
+
+        Keyword Arguments:
+            pmaps {bool} -- fill the PMaps columns, otherwise left at zero (default: {True})
+
+        Returns:
+            numpy.ndarray -- one SUMMARY_DTYPE row per entry
+        """
+        summary = numpy.zeros(self._max_entry, dtype=SUMMARY_DTYPE)
+        summary['entry'] = numpy.arange(0, self._max_entry)
+        summary['event'] = self._file['Run']['events']['evt_number']
+        summary['run']   = self._file['Run']['runInfo']['run_number']
+
+        if not pmaps or 'PMAPS' not in self._file:
+            return summary
+
+        if 'PMAPS' in self._readers:
+            indexes = self._readers['PMAPS'].indexes()
+        else:
+            indexes = event_indexes(self._file['PMAPS'], ['S1', 'S2'], self._index_cache, 'PMAPS/')
+
+        s1_start, s1_stop = indexes['S1'].ranges(summary['event'])
+        summary['has_s1'] = s1_stop > s1_start
+
+        # Cumulative sums over the S2 samples, taken at the event boundaries
+        # and differenced; S2 is scanned in blocks, carrying the sums over:
+        s2_start, s2_stop = indexes['S2'].ranges(summary['event'])
+        bounds = numpy.concatenate((s2_start, s2_stop))
+        peaks  = numpy.zeros(len(bounds), dtype=numpy.int64)
+        energy = numpy.zeros(len(bounds), dtype=numpy.float64)
+
+        n_peaks, total = 0, 0.
+        previous = None
+        s2 = self._file['PMAPS']['S2']
+        for offset, block in _column_blocks(s2, ['event', 'peak', 'ene']):
+            new_peak = numpy.ones(len(block), dtype=numpy.int64)
+            new_peak[1:] = (block['peak'][1:] != block['peak'][:-1]) | \
+                           (block['event'][1:] != block['event'][:-1])
+            if previous is not None:
+                new_peak[0] = (block['peak'][0], block['event'][0]) != previous
+            previous = (block['peak'][-1], block['event'][-1])
+
+            block_peaks  = numpy.concatenate(([n_peaks], n_peaks + numpy.cumsum(new_peak)))
+            block_energy = numpy.concatenate(([total], total + numpy.cumsum(block['ene'], dtype=numpy.float64)))
+
+            here = (bounds >= offset) & (bounds < offset + len(block))
+            peaks[here]  = block_peaks[bounds[here] - offset]
+            energy[here] = block_energy[bounds[here] - offset]
+            n_peaks, total = block_peaks[-1], block_energy[-1]
+
+        at_end = bounds >= len(s2)
+        peaks[at_end]  = n_peaks
+        energy[at_end] = total
+
+        n = len(s2_start)
+        summary['n_s2_peaks'] = peaks[n:] - peaks[:n]
+        summary['s2_energy']  = energy[n:] - energy[:n]
+        return summary
+
+    def iter_events(self, start=None, stop=None, fields=None, entries=None):
+        """Loop over events, yielding the requested products of each
+
+        Unlike go_to_entry, this does not change the current entry, and only
+        the products listed in fields are read.
+
+        Keyword Arguments:
+            start {int} -- first entry (default: {None}, the first entry)
+            stop {int} -- stop before this entry (default: {None}, the last entry)
+            fields {list} -- names of the products to read, see FIELDS (default: {None}, all)
+            entries {numpy.ndarray} -- only these entries, in this order (default: {None}, all)
+
+        Yields:
+            EventRecord -- one per entry
+        """
+        if fields is None:
+            fields = list(FIELDS.keys())
+        for field in fields:
+            if field not in FIELDS:
+                raise Exception("Unknown event field {}".format(field))
+
+        readers = dict((field, self._reader(FIELDS[field])) for field in fields)
+
+        # A range of entries is walked without making an array of them:
+        if entries is None:
+            first = 0 if start is None else max(start, 0)
+            last  = self._max_entry if stop is None else min(stop, self._max_entry)
+            entries = range(first, last)
+        else:
+            if start is not None:
+                entries = entries[entries >= start]
+            if stop is not None:
+                entries = entries[entries < stop]
+
+        for entry in entries:
+            row = self._events[entry]
+            event = row['evt_number']
+            record = EventRecord(entry, event, self._runs[entry]['run_number'], row['timestamp'])
+
+            for field, reader in readers.items():
+                if reader is None:
+                    continue
+                if field == 'mc_hits':
+                    record.mc_hits = reader.hits(event)
+                elif field == 'mc_particles':
+                    record.mc_particles = reader.particles(event)
+                elif field == 'reco_hits':
+                    record.reco_hits = reader.hits(event)
+                else:
+                    setattr(record, field, getattr(reader, field)(event))
+
+            yield record
+
     def go_to_entry(self,entry):
         """Move the current index to the specified entry
 
@@ -336,12 +774,12 @@ class IOManager(object):
             entry {int} -- Desired entry
         """
 
-        if entry in self._entries:
+        if 0 <= entry < self._max_entry:
             self._current_entry = entry
-            if self._pmaps is not None:
-                self._pmaps.set_event(self.event())
-            if self._reco is not None:
-                self._reco.set_event(self.event())
+            if self.pmaps() is not None:
+                self.pmaps().set_event(self.event())
+            if self.reco() is not None:
+                self.reco().set_event(self.event())
         else:
             print("Can't go to entry {}, entry is out of range.".format(entry))
 
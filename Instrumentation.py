@@ -0,0 +1,158 @@
+import sys
+import csv
+import json
+from contextlib import contextmanager
+from timeit import default_timer
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def peak_rss():
+    """Peak resident memory of this process in bytes, None where unknown"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes:
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class Instrumentation(object):
+    """Per event, per stage timing and counters for the event loop
+
+    Each event is opened with start_event and closed with end_event.  In
+    between, `with stage(name):` blocks accumulate wall time per stage and
+    count(name, n) accumulates counters (hits, voxels, bytes read...).
+    Every progress_interval events a progress line is printed, and at the
+    end a summary table is printed and the per event trace is written to
+    trace_file, as CSV if it ends in .csv and as JSON otherwise.  The
+    summary ends with the peak resident memory of the process.
+    """
+
+    # Stages in the order they are reported, others follow alphabetically
+    STAGES = ['read', 'mc', 'pmaps', 'reco', 'save']
+
+    def __init__(self, progress_interval=100, trace_file=None, stream=None):
+        super(Instrumentation, self).__init__()
+        self._progress_interval = progress_interval
+        self._trace_file        = trace_file
+        self._stream            = stream if stream is not None else sys.stdout
+
+        self._events    = []
+        self._current   = None
+        self._totals    = dict()
+        self._counts    = dict()
+        self._n_events  = 0
+        self._converted = 0
+        self._start     = default_timer()
+
+    def start_event(self):
+        self._current = {'stages' : dict(), 'counts' : dict()}
+
+    @contextmanager
+    def stage(self, name):
+        start = default_timer()
+        try:
+            yield
+        finally:
+            elapsed = default_timer() - start
+            stages = self._current['stages']
+            stages[name] = stages.get(name, 0.) + elapsed
+
+    def count(self, name, n):
+        counts = self._current['counts']
+        counts[name] = counts.get(name, 0) + int(n)
+
+    def end_event(self, entry, event, converted):
+        """Close the current event
+
+        Arguments:
+            entry {int} -- input entry
+            event {int} -- event number
+            converted {bool} -- whether the event was saved
+        """
+        current, self._current = self._current, None
+
+        for name, elapsed in current['stages'].items():
+            self._totals[name] = self._totals.get(name, 0.) + elapsed
+        for name, n in current['counts'].items():
+            self._counts[name] = self._counts.get(name, 0) + n
+
+        self._n_events += 1
+        if converted:
+            self._converted += 1
+
+        if self._trace_file is not None:
+            current['entry']     = int(entry)
+            current['event']     = int(event)
+            current['converted'] = bool(converted)
+            self._events.append(current)
+
+        n_events = self.n_events()
+        if self._progress_interval and n_events % self._progress_interval == 0:
+            elapsed = default_timer() - self._start
+            self._stream.write("Processed entry {} ({:.1f} events/s).\n".format(
+                n_events, n_events / elapsed if elapsed > 0 else 0.))
+
+    def abort_event(self):
+        """Drop the current event without recording it (e.g. end of input)"""
+        self._current = None
+
+    def n_events(self):
+        return self._n_events
+
+    def stages(self):
+        known = [ name for name in self.STAGES if name in self._totals ]
+        return known + sorted(name for name in self._totals if name not in self.STAGES)
+
+    def summary(self):
+        """Summary table of the time spent per stage and the counters"""
+        n_events = max(1, self.n_events())
+        elapsed  = default_timer() - self._start
+        staged   = sum(self._totals.values())
+
+        lines = []
+        lines.append("{:<12s} {:>10s} {:>12s} {:>8s}".format("stage", "total [s]", "per evt [ms]", "share"))
+        for name in self.stages():
+            total = self._totals[name]
+            lines.append("{:<12s} {:10.3f} {:12.3f} {:7.1f}%".format(
+                name, total, 1e3 * total / n_events, 100. * total / staged if staged > 0 else 0.))
+        lines.append("{:<12s} {:10.3f} {:12.3f}".format("wall", elapsed, 1e3 * elapsed / n_events))
+
+        for name in sorted(self._counts):
+            lines.append("{:<12s} {:>10d} {:12.1f} per event".format(
+                name, self._counts[name], float(self._counts[name]) / n_events))
+
+        lines.append("{} events read, {} converted, {:.1f} events/s".format(
+            self.n_events(), self._converted, self.n_events() / elapsed if elapsed > 0 else 0.))
+
+        rss = peak_rss()
+        if rss is not None:
+            lines.append("peak RSS {:.1f} MB".format(rss / 1024.**2))
+        return "\n".join(lines)
+
+    def write_trace(self):
+        """Write the per event trace to trace_file, if one was given"""
+        if self._trace_file is None:
+            return
+
+        if self._trace_file.endswith('.csv'):
+            stages = self.stages()
+            counts = sorted(set(name for e in self._events for name in e['counts']))
+            with open(self._trace_file, 'w') as _trace:
+                writer = csv.writer(_trace)
+                writer.writerow(['entry', 'event', 'converted'] +
+                                [ name + '_s' for name in stages ] + counts)
+                for e in self._events:
+                    writer.writerow([e['entry'], e['event'], int(e['converted'])] +
+                                    [ e['stages'].get(name, 0.) for name in stages ] +
+                                    [ e['counts'].get(name, 0) for name in counts ])
+        else:
+            with open(self._trace_file, 'w') as _trace:
+                json.dump({'events' : self._events, 'peak_rss' : peak_rss()}, _trace)
+
+    def finalize(self):
+        self._stream.write(self.summary() + "\n")
+        self.write_trace()
@@ -0,0 +1,113 @@
+from larcv import larcv
+
+from OutputWriter import OutputWriter
+import larcv_voxels
+
+
+class LarcvWriter(OutputWriter):
+    """Writes the products to a larcv file through larcv.IOManager
+
+    The voxels are filled straight into the event products of the
+    IOManager, which are cleared for every entry; the vectors stored as
+    meta data are copied by store, so one per key is made and reused.
+    """
+
+    def __init__(self):
+        super(LarcvWriter, self).__init__()
+        self._io    = None
+        self._metas = dict()
+
+        # Vectors reused from one entry to the next, per producer and key:
+        self._vectors = dict()
+
+    def open(self, file_name):
+        # Serializing and compressing an entry is all C++: let other python
+        # threads run meanwhile, so AsyncWriter overlaps it with conversion.
+        try:
+            larcv.IOManager.save_entry.__release_gil__ = True
+        except (AttributeError, TypeError):
+            pass
+
+        self._io = larcv.IOManager(larcv.IOManager.kWRITE)
+        self._io.set_out_file(file_name)
+        self._io.initialize()
+
+    def add_meta(self, name, origin, voxel_size, n_voxels):
+        meta = larcv.ImageMeta3D()
+        for axis in range(3):
+            meta.set_dimension(axis, float(voxel_size[axis] * n_voxels[axis]),
+                               int(n_voxels[axis]), float(origin[axis]))
+        self._metas[name] = meta
+
+    def meta(self, name):
+        """The larcv.ImageMeta3D of a grid declared with add_meta"""
+        return self._metas[name]
+
+    def write_particles(self, producer, particles):
+        particle_set = larcv.EventParticle.to_particle(
+            self._io.get_data("particle", producer))
+        particle_set.clear()
+
+        for particle in particles:
+            larcv_particle = larcv.Particle()
+            larcv_particle.id(int(particle['id']))
+            larcv_particle.track_id(int(particle['track_id']))
+            larcv_particle.parent_track_id(int(particle['parent_track_id']))
+            larcv_particle.pdg_code(int(particle['pdg_code']))
+            larcv_particle.position(*particle['position'].tolist())
+            larcv_particle.end_position(*particle['end_position'].tolist())
+            larcv_particle.momentum(*particle['momentum'].tolist())
+            larcv_particle.energy_init(float(particle['energy_init']))
+            larcv_particle.creation_process(str(particle['creation_process'].decode()))
+            particle_set.append(larcv_particle)
+
+    def write_sparse3d(self, producer, meta, index, values):
+        event_tensor = larcv.EventSparseTensor3D.to_sparse_tensor(
+            self._io.get_data("sparse3d", producer))
+        event_tensor.clear()
+        event_tensor.meta(self._metas[meta])
+        return larcv_voxels.fill_voxel_set(event_tensor, index, values, aggregated=True)
+
+    def write_cluster3d(self, producer, meta, n_clusters, cluster, index, values):
+        event_cluster = larcv.EventSparseCluster3D.to_sparse_cluster(
+            self._io.get_data("cluster3d", producer))
+        event_cluster.clear()
+        event_cluster.meta(self._metas[meta])
+        event_cluster.resize(n_clusters)
+        larcv_voxels.fill_clusters(event_cluster, cluster, index, values, aggregated=True)
+        return len(index)
+
+    def write_vector(self, producer, key, values):
+        vector = self._vectors.get((producer, key))
+        if vector is None:
+            vector = self._vectors[producer, key] = larcv.VectorOfDouble()
+        vector.clear()
+        vector.reserve(len(values))
+        for value in values.tolist():
+            vector.push_back(value)
+        self._io.get_data("meta", producer).store(key, vector)
+
+    def clear_entry(self):
+        self._io.clear_entry()
+
+    def save_entry(self, run, subrun, event):
+        self._io.set_id(int(run), int(subrun), int(event))
+        self._io.save_entry()
+
+    def finalize(self):
+        self._io.finalize()
+
+
+def merge_files(inputs, _file_out):
+    """Concatenate larcv files, keeping the order of inputs and of their entries"""
+    io = larcv.IOManager(larcv.IOManager.kBOTH)
+    for _file_in in inputs:
+        io.add_in_file(_file_in)
+    io.set_out_file(_file_out)
+    io.initialize()
+
+    for entry in range(io.get_n_entries()):
+        io.read_entry(entry)
+        io.save_entry()
+
+    io.finalize()
@@ -0,0 +1,110 @@
+import numpy
+
+
+# Particles are handed to the writers as a record array of this type:
+PARTICLE_DTYPE = numpy.dtype([
+    ('id',               'i4'),
+    ('track_id',         'i4'),
+    ('parent_track_id',  'i4'),
+    ('pdg_code',         'i4'),
+    ('position',         'f8', (4,)),
+    ('end_position',     'f8', (4,)),
+    ('momentum',         'f8', (3,)),
+    ('energy_init',      'f8'),
+    ('creation_process', 'S20'),
+])
+
+BACKENDS = ['larcv', 'hdf5']
+
+
+class OutputWriter(object):
+    """Output format of the converter
+
+    The converter computes every product as numpy arrays and hands them to
+    a writer, which owns the output file.  Products are named by a type
+    (particle, sparse3d, cluster3d, vector) and a producer, as in larcv.
+    Voxels are given as (index, value) arrays already summed per voxel, with
+    the index computed on one of the grids declared with add_meta.
+
+    Writing a product again before save_entry replaces it.  save_entry
+    stores all products written since the last save_entry or clear_entry,
+    and products not written for an entry are stored empty.
+    """
+
+    def open(self, file_name):
+        raise NotImplementedError()
+
+    def add_meta(self, name, origin, voxel_size, n_voxels):
+        """Declare a voxel grid that products can refer to by name"""
+        raise NotImplementedError()
+
+    def write_particles(self, producer, particles):
+        """Particles, a record array of PARTICLE_DTYPE"""
+        raise NotImplementedError()
+
+    def write_sparse3d(self, producer, meta, index, values):
+        """Voxels with sorted, unique indexes
+
+        Returns:
+            int -- number of voxels written
+        """
+        raise NotImplementedError()
+
+    def write_cluster3d(self, producer, meta, n_clusters, cluster, index, values):
+        """Voxels of n_clusters clusters, sorted by cluster then index"""
+        raise NotImplementedError()
+
+    def write_vector(self, producer, key, values):
+        """A named vector of floats stored with the entry"""
+        raise NotImplementedError()
+
+    def clear_entry(self):
+        """Drop what was written for an entry that is not going to be saved"""
+        raise NotImplementedError()
+
+    def save_entry(self, run, subrun, event):
+        raise NotImplementedError()
+
+    def finalize(self):
+        raise NotImplementedError()
+
+    def close(self):
+        """Release the writer after a failed conversion, without finalizing"""
+        pass
+
+
+def make_writer(backend='larcv', **options):
+    """Create the writer of an output backend
+
+    The modules of the backends are only imported here, so larcv is not
+    needed unless its backend is used.
+
+    Arguments:
+        backend {str} -- one of BACKENDS (default: {'larcv'})
+
+    Returns:
+        OutputWriter
+    """
+    if backend == 'larcv':
+        from LarcvWriter import LarcvWriter
+        return LarcvWriter(**options)
+    if backend == 'hdf5':
+        from HDF5Writer import HDF5Writer
+        return HDF5Writer(**options)
+    raise Exception("Unknown output backend {}, use one of {}".format(backend, BACKENDS))
+
+
+def output_suffix(backend='larcv'):
+    """Suffix of the default output name of a backend"""
+    return {'larcv' : '_larcv', 'hdf5' : '_voxels'}[backend]
+
+
+def merge_outputs(inputs, _file_out, backend='larcv'):
+    """Concatenate output files of a backend, keeping the order of inputs"""
+    if backend == 'larcv':
+        from LarcvWriter import merge_files
+    elif backend == 'hdf5':
+        from HDF5Writer import merge_files
+    else:
+        raise Exception("Unknown output backend {}, use one of {}".format(backend, BACKENDS))
+    merge_files(inputs, _file_out)
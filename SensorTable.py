@@ -0,0 +1,51 @@
+import numpy
+
+
+class SensorTable(object):
+    """Dense numpy lookup arrays for one type of sensor
+
+    Built once from a DataPMT or DataSiPM table (DataFrame or record array).
+    The sensor numbers stored in the PMaps tables (nsipm, npmt) are positions
+    in these tables, so x, y, active and gain are indexed by position and
+    can be used directly with arrays of sensor numbers.  SensorID and
+    ChannelID are not positions; position_of_sensor and position_of_channel
+    translate them through dense arrays indexed by id.
+    """
+    def __init__(self, table):
+        super(SensorTable, self).__init__()
+
+        self.sensor_id  = numpy.asarray(table.SensorID,   dtype=numpy.int64)
+        self.channel_id = numpy.asarray(table.ChannelID,  dtype=numpy.int64)
+        self.x          = numpy.asarray(table.X,          dtype=numpy.float64)
+        self.y          = numpy.asarray(table.Y,          dtype=numpy.float64)
+        self.active     = numpy.asarray(table.Active,     dtype=numpy.int64) != 0
+        self.gain       = numpy.asarray(table.adc_to_pes, dtype=numpy.float64)
+
+        self._by_sensor  = self._dense_positions(self.sensor_id)
+        self._by_channel = self._dense_positions(self.channel_id)
+
+    @staticmethod
+    def _dense_positions(ids):
+        """Array with the position of each id at index id, -1 elsewhere"""
+        positions = numpy.full(ids.max() + 1 if len(ids) else 0, -1, dtype=numpy.int64)
+        positions[ids] = numpy.arange(len(ids))
+        return positions
+
+    @staticmethod
+    def _lookup(positions, ids):
+        ids = numpy.asarray(ids, dtype=numpy.int64)
+        result = numpy.full(ids.shape, -1, dtype=numpy.int64)
+        known = (ids >= 0) & (ids < len(positions))
+        result[known] = positions[ids[known]]
+        return result
+
+    def __len__(self):
+        return len(self.sensor_id)
+
+    def position_of_sensor(self, sensor_ids):
+        """Positions of the given SensorIDs, -1 for unknown ids"""
+        return self._lookup(self._by_sensor, sensor_ids)
+
+    def position_of_channel(self, channel_ids):
+        """Positions of the given ChannelIDs, -1 for unknown ids"""
+        return self._lookup(self._by_channel, channel_ids)
@@ -0,0 +1,111 @@
+"""Memory allocated per event by the conversion stages
+
+Runs the converter on a synthetic fixture (see run_benchmarks) under
+tracemalloc, with and without the reused scratch buffers of the event
+loop, and reports per stage the memory allocated above what was already
+held when the stage started, averaged over the events after a warm up.
+larcv is replaced by fake_larcv, and the compiled bridge filling the
+voxels by a stand-in that drops them: like in the C++ of larcv, the
+memory of the written voxels is then not part of the measurement.
+
+    python benchmarks/bench_allocations.py --events 200
+"""
+import os, sys
+import argparse
+import tempfile
+import tracemalloc
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARK_DIR)
+
+# Installs fake_larcv and puts the converter on the path:
+from run_benchmarks import prepare, _Quiet
+from Converter import Converter
+import larcv_voxels
+
+
+def _drop_voxels(voxel_set, ids, values, n):
+    """Stand-in for larcv_voxels' compiled bridge"""
+    pass
+
+
+class TracedConverter(Converter):
+    """Converter recording the peak memory allocated by each stage of each event"""
+
+    def __init__(self, **options):
+        super(TracedConverter, self).__init__(**options)
+        self.allocated = dict()
+
+    def _traced(self, stage, method, record):
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        result = method(record)
+        self.allocated.setdefault(stage, []).append(tracemalloc.get_traced_memory()[1] - before)
+        return result
+
+    def convert_mc_information(self, record):
+        return self._traced('mc', super(TracedConverter, self).convert_mc_information, record)
+
+    def convert_pmaps(self, record):
+        return self._traced('pmaps', super(TracedConverter, self).convert_pmaps, record)
+
+    def convert_reco(self, record):
+        return self._traced('reco', super(TracedConverter, self).convert_reco, record)
+
+
+def measure(ic_file, snapshot, work_dir, reuse_buffers, warm_up):
+    """Mean bytes allocated per event by each stage, after warm_up events"""
+    converter = TracedConverter(geometry_snapshot=snapshot, progress_interval=0,
+                                reuse_buffers=reuse_buffers)
+    tracemalloc.start()
+    try:
+        with _Quiet():
+            converter.convert(ic_file, os.path.join(work_dir, 'output_larcv.h5'))
+    finally:
+        tracemalloc.stop()
+
+    means = dict()
+    for stage, allocated in converter.allocated.items():
+        steady = allocated[warm_up:] or allocated
+        means[stage] = float(sum(steady)) / len(steady)
+    return means, converter._buffers.nbytes()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the memory allocated per event')
+    parser.add_argument('--events', type=int, default=200,
+                        help='integer, Number of events in the fixture (default 200)')
+    parser.add_argument('--hits', type=int, default=200,
+                        help='integer, Mean number of MC hits per event (default 200)')
+    parser.add_argument('--warm-up', type=int, default=20, dest='warm_up',
+                        help='integer, Events left out while the buffers grow (default 20)')
+    parser.add_argument('--work-dir', default=os.path.join(tempfile.gettempdir(), 'ictolarcv_benchmarks'),
+                        help='string,  Directory for the fixtures (default: in the temporary directory)')
+    args = parser.parse_args()
+
+    params = dict(n_events=args.events, hits_per_event=args.hits,
+                  sipms_per_peak=30, s2_samples=15)
+    ic_file, snapshot = prepare(args.work_dir, params)
+    larcv_voxels._bridge = _drop_voxels
+
+    # Relative database paths are resolved from the work directory:
+    cwd = os.getcwd()
+    os.chdir(args.work_dir)
+    try:
+        fresh,  _       = measure(ic_file, snapshot, args.work_dir, False, args.warm_up)
+        reused, pool_nb = measure(ic_file, snapshot, args.work_dir, True,  args.warm_up)
+    finally:
+        os.chdir(cwd)
+
+    print("{:<8s} {:>16s} {:>16s} {:>8s}".format("stage", "fresh [kB/evt]", "reused [kB/evt]", "change"))
+    for stage in ['mc', 'pmaps', 'reco']:
+        if stage not in fresh:
+            continue
+        print("{:<8s} {:16.1f} {:16.1f} {:7.1f}%".format(
+            stage, fresh[stage] / 1024., reused[stage] / 1024.,
+            100. * (reused[stage] - fresh[stage]) / fresh[stage] if fresh[stage] else 0.))
+    print("scratch buffers held: {:.1f} kB".format(pool_nb / 1024.))
+
+
+if __name__ == '__main__':
+    main()
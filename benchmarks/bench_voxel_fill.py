@@ -0,0 +1,85 @@
+"""Per-voxel cost of filling a larcv SparseTensor3D
+
+Compares the per-voxel emplace the converters used to do with
+larcv_voxels.fill_voxel_set, through the compiled bridge and through its
+python fallback.  Needs ROOT and larcv.
+
+    python benchmarks/bench_voxel_fill.py --voxels 100000
+"""
+import os, sys
+import argparse
+import time
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from larcv import larcv
+import larcv_voxels
+
+
+def make_meta():
+    meta = larcv.ImageMeta3D()
+    meta.set_dimension(0, 470., 470, -235.)
+    meta.set_dimension(1, 470., 470, -235.)
+    meta.set_dimension(2, 532., 532,    0.)
+    return meta
+
+
+def per_voxel(meta, index, values):
+    st = larcv.SparseTensor3D()
+    st.meta(meta)
+    for voxel_id, value in zip(index.tolist(), values.tolist()):
+        st.emplace(larcv.Voxel(voxel_id, value))
+    return st
+
+
+def bulk(meta, index, values):
+    st = larcv.SparseTensor3D()
+    st.meta(meta)
+    larcv_voxels.fill_voxel_set(st, index, values, aggregated=True)
+    return st
+
+
+def timed(function, repeat, *args):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        function(*args)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark voxel insertion into larcv')
+    parser.add_argument('--voxels', type=int, default=100000,
+                        help='integer, Number of voxels per tensor (default 100000)')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='integer, Repetitions, the best time is kept (default 5)')
+    args = parser.parse_args()
+
+    meta = make_meta()
+    n_total = 470 * 470 * 532
+    rng = numpy.random.RandomState(0)
+    index  = numpy.unique(rng.randint(0, n_total, size=args.voxels))
+    values = rng.uniform(0, 1, size=len(index))
+
+    results = [('per-voxel emplace', timed(per_voxel, args.repeat, meta, index, values))]
+
+    if larcv_voxels.native_available():
+        results.append(('fill_voxel_set (bridge)', timed(bulk, args.repeat, meta, index, values)))
+
+    # Force the python fallback:
+    bridge = larcv_voxels._bridge
+    larcv_voxels._bridge = False
+    results.append(('fill_voxel_set (fallback)', timed(bulk, args.repeat, meta, index, values)))
+    larcv_voxels._bridge = bridge
+
+    print("{} voxels".format(len(index)))
+    for name, elapsed in results:
+        print("{:<28s} {:10.1f} ns/voxel".format(name, 1e9 * elapsed / len(index)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,254 @@
+"""Stand-in for the parts of larcv used by the converter
+
+Lets the benchmarks run the real conversion code without ROOT or larcv.
+The writer keeps the products of the current entry in memory and, on
+save_entry, only counts entries and voxels per product, so the numbers
+measure the converter itself rather than ROOT I/O.
+
+    import fake_larcv
+    fake_larcv.install()      # before importing Converter
+"""
+import sys
+import math
+import types
+
+
+# larcv::kINVALID_INDEX
+INVALID_INDEX = 2**64 - 1
+
+
+class Voxel(object):
+    __slots__ = ['id', 'value']
+
+    def __init__(self, voxel_id, value):
+        self.id    = voxel_id
+        self.value = value
+
+
+class VoxelSet(object):
+    def __init__(self):
+        super(VoxelSet, self).__init__()
+        self._voxels = dict()
+
+    def add(self, voxel):
+        self._voxels[voxel.id] = self._voxels.get(voxel.id, 0.) + voxel.value
+
+    def emplace(self, voxel, add=True):
+        if add:
+            self.add(voxel)
+        else:
+            self._voxels[voxel.id] = voxel.value
+
+    def clear(self):
+        self._voxels.clear()
+
+    clear_data = clear
+
+    def size(self):
+        return len(self._voxels)
+
+
+class SparseTensor3D(VoxelSet):
+    def __init__(self):
+        super(SparseTensor3D, self).__init__()
+        self._meta = None
+
+    def meta(self, meta=None):
+        if meta is not None:
+            self._meta = meta
+        return self._meta
+
+
+class SparseCluster3D(object):
+    def __init__(self):
+        super(SparseCluster3D, self).__init__()
+        self._meta = None
+        self._sets = []
+
+    def meta(self, meta=None):
+        if meta is not None:
+            self._meta = meta
+        return self._meta
+
+    def clear_data(self):
+        self._sets = []
+
+    def resize(self, n):
+        self._sets = self._sets[:n] + [ VoxelSet() for _ in range(n - len(self._sets)) ]
+
+    def writeable_voxel_set(self, i):
+        return self._sets[i]
+
+    def size(self):
+        return sum(s.size() for s in self._sets)
+
+
+class VectorOfDouble(list):
+    def push_back(self, value):
+        self.append(value)
+
+    def clear(self):
+        del self[:]
+
+    def reserve(self, n):
+        pass
+
+    def resize(self, n):
+        self[:] = [0.] * n
+
+
+class ImageMeta3D(object):
+    def __init__(self):
+        super(ImageMeta3D, self).__init__()
+        self._length = [0., 0., 0.]
+        self._n      = [0, 0, 0]
+        self._origin = [0., 0., 0.]
+
+    def set_dimension(self, axis, length, n, origin):
+        self._length[axis] = float(length)
+        self._n[axis]      = int(n)
+        self._origin[axis] = float(origin)
+
+    def position_to_index(self, position):
+        index = []
+        for axis in range(3):
+            size = self._length[axis] / self._n[axis]
+            i = int(math.floor((position[axis] - self._origin[axis]) / size))
+            if not 0 <= i < self._n[axis]:
+                return INVALID_INDEX
+            index.append(i)
+        return index[0] + self._n[0] * (index[1] + self._n[1] * index[2])
+
+    def dump(self):
+        return "ImageMeta3D n={} length={} origin={}".format(self._n, self._length, self._origin)
+
+
+class Particle(object):
+    """Accepts and ignores all the setters of larcv::Particle"""
+    def __getattr__(self, name):
+        return lambda *args : None
+
+
+class EventSparseTensor3D(SparseTensor3D):
+    """The event product is itself a SparseTensor3D"""
+    @staticmethod
+    def to_sparse_tensor(product):
+        return product
+
+
+class EventSparseCluster3D(SparseCluster3D):
+    """The event product is itself a SparseCluster3D"""
+    @staticmethod
+    def to_sparse_cluster(product):
+        return product
+
+    def clear(self):
+        self.clear_data()
+
+
+class EventProduct(object):
+    """Holds whatever the converter emplaces for one entry"""
+    def __init__(self):
+        super(EventProduct, self).__init__()
+        self.items  = []
+        self.stored = dict()
+
+    def clear(self):
+        self.items  = []
+        self.stored = dict()
+
+    def emplace(self, item):
+        self.items.append(item)
+
+    append = emplace
+
+    def store(self, key, value):
+        self.stored[key] = list(value)
+
+    def size(self):
+        return sum(item.size() for item in self.items
+                   if isinstance(item, (VoxelSet, SparseCluster3D)))
+
+
+class EventParticle(EventProduct):
+    @staticmethod
+    def to_particle(product):
+        return product
+
+
+# Class of the event product made by IOManager.get_data for each product name:
+EVENT_PRODUCTS = {
+    'sparse3d'  : EventSparseTensor3D,
+    'cluster3d' : EventSparseCluster3D,
+    'particle'  : EventParticle,
+}
+
+
+class IOManager(object):
+    kREAD, kWRITE, kBOTH = 0, 1, 2
+
+    def __init__(self, mode):
+        super(IOManager, self).__init__()
+        self._mode     = mode
+        self._out_file = None
+        self._products = dict()
+        self.entries   = 0
+        self.voxels    = dict()
+
+    def set_out_file(self, name):
+        self._out_file = name
+
+    def initialize(self):
+        pass
+
+    def get_data(self, product, producer):
+        key = (product, producer)
+        if key not in self._products:
+            self._products[key] = EVENT_PRODUCTS.get(product, EventProduct)()
+        return self._products[key]
+
+    def set_id(self, run, subrun, event):
+        pass
+
+    def clear_entry(self):
+        for product in self._products.values():
+            product.clear()
+
+    def save_entry(self):
+        self.entries += 1
+        for key, product in self._products.items():
+            self.voxels[key] = self.voxels.get(key, 0) + product.size()
+            product.clear()
+
+    def finalize(self):
+        pass
+
+
+def make_module():
+    """A `larcv` package whose `larcv` attribute holds the stand-in classes"""
+    namespace = types.ModuleType('larcv.larcv')
+    for name, value in dict(
+            Voxel                = Voxel,
+            VoxelSet             = VoxelSet,
+            SparseTensor3D       = SparseTensor3D,
+            SparseCluster3D      = SparseCluster3D,
+            VectorOfDouble       = VectorOfDouble,
+            ImageMeta3D          = ImageMeta3D,
+            Particle             = Particle,
+            EventSparseTensor3D  = EventSparseTensor3D,
+            EventSparseCluster3D = EventSparseCluster3D,
+            EventParticle        = EventParticle,
+            IOManager            = IOManager).items():
+        setattr(namespace, name, value)
+
+    package = types.ModuleType('larcv')
+    package.larcv = namespace
+    return package
+
+
+def install():
+    """Make `from larcv import larcv` return the stand-in"""
+    package = make_module()
+    sys.modules['larcv']       = package
+    sys.modules['larcv.larcv'] = package.larcv
+    return package.larcv
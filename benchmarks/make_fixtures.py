@@ -0,0 +1,352 @@
+"""Synthetic IC HDF5 files and sensor database for the benchmarks
+
+The files follow the layout of the diomira/irene outputs the converter
+reads: Run/events and Run/runInfo, MC/extents, MC/hits and MC/particles,
+PMAPS/S1, S1Pmt, S2, S2Pmt and S2Si, and RECO/Events, as chunked gzip
+tables.  Each event is a track of MC hits, one S1 peak and a few S2 peaks
+seen by all the PMTs and by a patch of SiPMs around the track, and the
+reconstructed hits of every S2 sample.  Everything is drawn from a seeded
+generator, so the same arguments always give the same file.
+
+    python benchmarks/make_fixtures.py -o fixture.h5 --db localdb.sqlite3 --events 1000
+"""
+import os
+import argparse
+import sqlite3
+
+import numpy
+import h5py
+
+
+# Sensor layout of the fake database, close to NEXT-White:
+N_PMTS        = 12
+N_SIPM_BOARDS = 28
+SIPMS_PER_BOARD = 64
+SIPM_PITCH    = 10.
+SIPMS_PER_ROW = 48
+DETECTOR_GEO  = (-198., 198., -198., 198., 0., 532., 198.)
+
+RUN_NUMBER = -5906
+
+PARTICLE_NAMES = [b'e-', b'e+', b'gamma']
+
+S1_DTYPE   = [('event', '<i4'), ('peak', 'u1'), ('time', '<f4'), ('ene', '<f4')]
+PMT_DTYPE  = [('event', '<i4'), ('peak', 'u1'), ('npmt', 'u1'), ('ene', '<f4')]
+SIPM_DTYPE = [('event', '<i4'), ('peak', 'u1'), ('nsipm', '<i2'), ('ene', '<f4')]
+
+HIT_DTYPE = [('hit_position', '<f4', (3,)), ('hit_time', '<f8'), ('hit_energy', '<f4'),
+             ('label', 'S20'), ('particle_indx', '<i2'), ('hit_indx', '<i2')]
+
+PARTICLE_DTYPE = [('particle_indx', '<i2'), ('particle_name', 'S20'), ('primary', '<i2'),
+                  ('mother_indx', '<i2'), ('initial_vertex', '<f4', (4,)),
+                  ('final_vertex', '<f4', (4,)), ('initial_volume', 'S20'),
+                  ('final_volume', 'S20'), ('momentum', '<f4', (3,)),
+                  ('kin_energy', '<f4'), ('creator_proc', 'S20')]
+
+RECO_DTYPE = [('event', '<i4'), ('time', '<f8'), ('npeak', '<u2'), ('nsipm', '<u2'),
+              ('X', '<f8'), ('Y', '<f8'), ('Xrms', '<f8'), ('Yrms', '<f8'),
+              ('Z', '<f8'), ('Q', '<f8'), ('E', '<f8')]
+
+
+def sipm_positions():
+    """SensorID, X and Y of every SiPM of the fake database"""
+    n_sipms = N_SIPM_BOARDS * SIPMS_PER_BOARD
+    k = numpy.arange(n_sipms)
+    sensor_id = 1000 * (1 + k // SIPMS_PER_BOARD) + k % SIPMS_PER_BOARD
+    offset = -SIPM_PITCH * (SIPMS_PER_ROW - 1) / 2.
+    x = offset + SIPM_PITCH * (k % SIPMS_PER_ROW)
+    y = offset + SIPM_PITCH * (k // SIPMS_PER_ROW)
+    return sensor_id, x, y
+
+
+def make_sensor_db(db_file, masked=(1005,)):
+    """Write a sensor database with the tables load_db reads
+
+    Arguments:
+        db_file {str} -- sqlite file to (over)write
+
+    Keyword Arguments:
+        masked {tuple} -- SensorIDs listed in ChannelMask (default: {(1005,)})
+    """
+    if os.path.exists(db_file):
+        os.remove(db_file)
+
+    conn = sqlite3.connect(db_file)
+    conn.executescript('''
+        create table ChannelPosition (MinRun, MaxRun, SensorID, Label, Type, X, Y);
+        create table ChannelMapping  (MinRun, MaxRun, ElecID, SensorID);
+        create table ChannelGain     (MinRun, MaxRun, SensorID, Centroid, ErrorCentroid, Sigma, ErrorSigma);
+        create table ChannelMask     (MinRun, MaxRun, SensorID);
+        create table PmtNoiseRms     (MinRun, MaxRun, ElecID, noise_rms);
+        create table PmtBlr          (MinRun, MaxRun, ElecID, coeff_c, coeff_blr);
+        create table DetectorGeo     (XMIN, XMAX, YMIN, YMAX, ZMIN, ZMAX, RMAX);
+        create table SipmBaseline    (MinRun, MaxRun, SensorID, Energy);
+        create table SipmNoisePDF    (MinRun, MaxRun, SensorID, BinEnergyPes, Probability);
+    ''')
+
+    # Runs are negative for MC:
+    first, last = -100000, 100000
+
+    angle = 2 * numpy.pi * numpy.arange(N_PMTS) / N_PMTS
+    for i in range(N_PMTS):
+        conn.execute('insert into ChannelPosition values (?,?,?,?,?,?,?)',
+                     (first, last, i, 'PMT{}'.format(i + 1), 'PMT',
+                      100. * numpy.cos(angle[i]), 100. * numpy.sin(angle[i])))
+        conn.execute('insert into ChannelMapping values (?,?,?,?)', (first, last, i, i))
+        conn.execute('insert into ChannelGain values (?,?,?,25.,0.1,1.,0.1)', (first, last, i))
+        conn.execute('insert into PmtNoiseRms values (?,NULL,?,0.8)', (first, i))
+        conn.execute('insert into PmtBlr values (?,NULL,?,2.9e-6,1.6e-3)', (first, i))
+
+    sensor_id, x, y = sipm_positions()
+    for sid, sx, sy in zip(sensor_id.tolist(), x.tolist(), y.tolist()):
+        conn.execute('insert into ChannelPosition values (?,?,?,?,?,?,?)',
+                     (first, last, sid, 'SiPM', 'SiPM', sx, sy))
+        conn.execute('insert into ChannelMapping values (?,?,?,?)', (first, last, sid, sid))
+        conn.execute('insert into ChannelGain values (?,?,?,16.,0.1,NULL,NULL)', (first, last, sid))
+        conn.execute('insert into SipmBaseline values (?,NULL,?,0.)', (first, sid))
+
+    for sid in masked:
+        conn.execute('insert into ChannelMask values (?,?,?)', (first, last, sid))
+    conn.execute('insert into DetectorGeo values (?,?,?,?,?,?,?)', DETECTOR_GEO)
+
+    conn.commit()
+    conn.close()
+
+
+class _Tables(object):
+    """Per event pieces of each table, concatenated at the end"""
+    def __init__(self):
+        super(_Tables, self).__init__()
+        self._pieces = dict()
+
+    def add(self, name, rows):
+        self._pieces.setdefault(name, []).append(rows)
+
+    def table(self, name, dtype):
+        pieces = self._pieces.get(name, [])
+        if not pieces:
+            return numpy.zeros(0, dtype=dtype)
+        return numpy.concatenate(pieces)
+
+
+def _event(rng, event, tables, hits_per_event, particles_per_event, s2_peaks,
+           s2_samples, sipms_per_peak, reco_hits_per_sample):
+    """Add the rows of one event to the tables"""
+
+    x_min, x_max, y_min, y_max, z_min, z_max, _ = DETECTOR_GEO
+
+    # MC truth: a random walk from a vertex inside the volume, hits shared
+    # out between the particles in order.
+    n_particles = max(1, rng.poisson(particles_per_event))
+    n_hits      = max(n_particles, rng.poisson(hits_per_event))
+
+    vertex = numpy.array([rng.uniform(0.6 * x_min, 0.6 * x_max),
+                          rng.uniform(0.6 * y_min, 0.6 * y_max),
+                          rng.uniform(z_min + 100., z_max - 100.)])
+    steps     = rng.normal(0., 1., (n_hits, 3))
+    positions = vertex + numpy.cumsum(steps, axis=0)
+    positions[:,0] = numpy.clip(positions[:,0], x_min, x_max)
+    positions[:,1] = numpy.clip(positions[:,1], y_min, y_max)
+    positions[:,2] = numpy.clip(positions[:,2], z_min, z_max)
+
+    particle_indx = numpy.arange(1, n_particles + 1)
+    owner = numpy.sort(rng.randint(0, n_particles, n_hits))
+    owner[:n_particles] = numpy.arange(n_particles)
+    owner.sort()
+
+    hits = numpy.zeros(n_hits, dtype=HIT_DTYPE)
+    hits['hit_position']  = positions
+    hits['hit_time']      = numpy.cumsum(rng.exponential(0.004, n_hits))
+    hits['hit_energy']    = rng.exponential(0.005, n_hits)
+    hits['label']         = b'ACTIVE'
+    hits['particle_indx'] = particle_indx[owner]
+    hits['hit_indx']      = numpy.arange(n_hits) - numpy.searchsorted(owner, owner)
+    tables.add('hits', hits)
+
+    first_hit = numpy.searchsorted(owner, numpy.arange(n_particles))
+    last_hit  = numpy.searchsorted(owner, numpy.arange(n_particles), side='right') - 1
+
+    particles = numpy.zeros(n_particles, dtype=PARTICLE_DTYPE)
+    particles['particle_indx']  = particle_indx
+    particles['particle_name']  = [ PARTICLE_NAMES[i] for i in rng.randint(0, len(PARTICLE_NAMES), n_particles) ]
+    particles['primary']        = particle_indx == 1
+    particles['mother_indx']    = numpy.where(particle_indx == 1, 0, rng.randint(1, n_particles + 1, n_particles))
+    particles['initial_vertex'][:,:3] = positions[first_hit]
+    particles['initial_vertex'][:,3]  = hits['hit_time'][first_hit]
+    particles['final_vertex'][:,:3]   = positions[last_hit]
+    particles['final_vertex'][:,3]    = hits['hit_time'][last_hit]
+    particles['initial_volume'] = b'ACTIVE'
+    particles['final_volume']   = b'ACTIVE'
+    particles['momentum']       = rng.normal(0., 0.5, (n_particles, 3))
+    particles['kin_energy']     = rng.exponential(0.3, n_particles)
+    particles['creator_proc']   = numpy.where(particle_indx == 1, b'none', b'eIoni')
+    tables.add('particles', particles)
+
+    # PMaps: one S1 peak, then S2 peaks following the track in z.  Times
+    # are in ns, z = (t - t0) / 1000 as in the converter.
+    s1_time = 100000. + 25. * numpy.arange(rng.randint(5, 15))
+    s1 = numpy.zeros(len(s1_time), dtype=S1_DTYPE)
+    s1['event'] = event
+    s1['time']  = s1_time
+    s1['ene']   = rng.exponential(5., len(s1_time))
+    tables.add('S1', s1)
+    tables.add('S1Pmt', _pmt_rows(rng, event, s1))
+
+    t0 = s1_time[numpy.argmax(s1['ene'])]
+    sensor_id, sipm_x, sipm_y = sipm_positions()
+
+    peak_z = numpy.sort(rng.choice(positions[:,2], s2_peaks))
+    for peak in range(s2_peaks):
+        n_samples = max(1, rng.poisson(s2_samples))
+        s2 = numpy.zeros(n_samples, dtype=S1_DTYPE)
+        s2['event'] = event
+        s2['peak']  = peak
+        s2['time']  = t0 + 1000. * (peak_z[peak] + numpy.arange(n_samples))
+        s2['ene']   = rng.exponential(300., n_samples)
+        tables.add('S2', s2)
+        tables.add('S2Pmt', _pmt_rows(rng, event, s2))
+
+        # The SiPMs closest to the track, each with one row per S2 sample:
+        centre = positions[rng.randint(n_hits), :2]
+        distance = numpy.hypot(sipm_x - centre[0], sipm_y - centre[1])
+        sipms = numpy.sort(numpy.argsort(distance)[:sipms_per_peak])
+
+        s2si = numpy.zeros(len(sipms) * n_samples, dtype=SIPM_DTYPE)
+        s2si['event'] = event
+        s2si['peak']  = peak
+        s2si['nsipm'] = numpy.repeat(sipms, n_samples)
+        s2si['ene']   = numpy.where(rng.uniform(size=len(s2si)) < 0.4,
+                                    rng.exponential(8., len(s2si)), 0.)
+        tables.add('S2Si', s2si)
+
+        # Reconstructed hits, a few per S2 sample around the centre:
+        n_reco = n_samples * reco_hits_per_sample
+        reco = numpy.zeros(n_reco, dtype=RECO_DTYPE)
+        reco['event'] = event
+        reco['time']  = t0
+        reco['npeak'] = peak
+        reco['nsipm'] = rng.randint(1, 10, n_reco)
+        reco['X']     = centre[0] + rng.normal(0., 8., n_reco)
+        reco['Y']     = centre[1] + rng.normal(0., 8., n_reco)
+        reco['Xrms']  = rng.uniform(2., 8., n_reco)
+        reco['Yrms']  = rng.uniform(2., 8., n_reco)
+        reco['Z']     = numpy.repeat(peak_z[peak] + numpy.arange(n_samples), reco_hits_per_sample)
+        reco['Q']     = rng.exponential(20., n_reco)
+        reco['E']     = rng.exponential(100., n_reco)
+        tables.add('Events', reco)
+
+    return n_hits, n_particles
+
+
+def _pmt_rows(rng, event, peak_rows):
+    """One row per PMT for every sample of a peak"""
+    rows = numpy.zeros(len(peak_rows) * N_PMTS, dtype=PMT_DTYPE)
+    rows['event'] = event
+    rows['peak']  = numpy.repeat(peak_rows['peak'], N_PMTS)
+    rows['npmt']  = numpy.tile(numpy.arange(N_PMTS), len(peak_rows))
+    rows['ene']   = numpy.repeat(peak_rows['ene'], N_PMTS) / N_PMTS * rng.uniform(0.5, 1.5, len(rows))
+    return rows
+
+
+def _write_table(group, name, data, chunk_bytes=32 * 1024):
+    chunk_rows = max(1, chunk_bytes // data.dtype.itemsize)
+    group.create_dataset(name, data=data, maxshape=(None,),
+                         chunks=(chunk_rows,), compression='gzip', compression_opts=4)
+
+
+def make_ic_file(file_name, n_events=100, hits_per_event=200, particles_per_event=20,
+                 s2_peaks=2, s2_samples=15, sipms_per_peak=30, reco_hits_per_sample=3,
+                 first_event=1, seed=0):
+    """Write a synthetic IC file
+
+    Arguments:
+        file_name {str} -- HDF5 file to (over)write
+
+    Keyword Arguments:
+        n_events {int} -- number of events (default: {100})
+        hits_per_event {int} -- mean number of MC hits per event (default: {200})
+        particles_per_event {int} -- mean number of MC particles per event (default: {20})
+        s2_peaks {int} -- S2 peaks per event (default: {2})
+        s2_samples {int} -- mean number of samples per S2 peak (default: {15})
+        sipms_per_peak {int} -- SiPMs seeing each S2 peak (default: {30})
+        reco_hits_per_sample {int} -- reconstructed hits per S2 sample (default: {3})
+        first_event {int} -- number of the first event (default: {1})
+        seed {int} -- random seed (default: {0})
+    """
+    rng    = numpy.random.RandomState(seed)
+    tables = _Tables()
+
+    n_hits      = numpy.zeros(n_events, dtype=numpy.uint64)
+    n_particles = numpy.zeros(n_events, dtype=numpy.uint64)
+    events = numpy.arange(first_event, first_event + n_events)
+    for i, event in enumerate(events):
+        n_hits[i], n_particles[i] = _event(rng, event, tables, hits_per_event,
+                                           particles_per_event, s2_peaks, s2_samples,
+                                           sipms_per_peak, reco_hits_per_sample)
+
+    run_events = numpy.zeros(n_events, dtype=[('evt_number', '<i4'), ('timestamp', '<u8')])
+    run_events['evt_number'] = events
+    run_info = numpy.full(n_events, RUN_NUMBER, dtype=[('run_number', '<i4')])
+
+    # last_hit and last_particle are the inclusive end of each event:
+    extents = numpy.zeros(n_events, dtype=[('evt_number', '<i4'), ('last_hit', '<u8'),
+                                           ('last_particle', '<u8')])
+    extents['evt_number']    = events
+    extents['last_hit']      = numpy.cumsum(n_hits) - 1
+    extents['last_particle'] = numpy.cumsum(n_particles) - 1
+
+    with h5py.File(file_name, 'w') as _file:
+        run = _file.create_group('Run')
+        _write_table(run, 'events',  run_events)
+        _write_table(run, 'runInfo', run_info)
+
+        mc = _file.create_group('MC')
+        _write_table(mc, 'extents',   extents)
+        _write_table(mc, 'hits',      tables.table('hits', HIT_DTYPE))
+        _write_table(mc, 'particles', tables.table('particles', PARTICLE_DTYPE))
+
+        pmaps = _file.create_group('PMAPS')
+        _write_table(pmaps, 'S1',    tables.table('S1',    S1_DTYPE))
+        _write_table(pmaps, 'S1Pmt', tables.table('S1Pmt', PMT_DTYPE))
+        _write_table(pmaps, 'S2',    tables.table('S2',    S1_DTYPE))
+        _write_table(pmaps, 'S2Pmt', tables.table('S2Pmt', PMT_DTYPE))
+        _write_table(pmaps, 'S2Si',  tables.table('S2Si',  SIPM_DTYPE))
+
+        reco = _file.create_group('RECO')
+        _write_table(reco, 'Events', tables.table('Events', RECO_DTYPE))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write synthetic IC files for the benchmarks')
+    parser.add_argument('-o', '--output', required=True,
+                        help='string,  Output HDF5 file')
+    parser.add_argument('--db', default=None,
+                        help='string,  Also write a fake sensor database to this file (optional)')
+    parser.add_argument('--events', type=int, default=100,
+                        help='integer, Number of events (default 100)')
+    parser.add_argument('--hits', type=int, default=200,
+                        help='integer, Mean number of MC hits per event (default 200)')
+    parser.add_argument('--particles', type=int, default=20,
+                        help='integer, Mean number of MC particles per event (default 20)')
+    parser.add_argument('--s2-peaks', type=int, default=2,
+                        help='integer, S2 peaks per event (default 2)')
+    parser.add_argument('--s2-samples', type=int, default=15,
+                        help='integer, Mean number of samples per S2 peak (default 15)')
+    parser.add_argument('--sipms', type=int, default=30,
+                        help='integer, SiPMs per S2 peak (default 30)')
+    parser.add_argument('--reco-hits', type=int, default=3,
+                        help='integer, Reconstructed hits per S2 sample (default 3)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='integer, Random seed (default 0)')
+    args = parser.parse_args()
+
+    make_ic_file(args.output, n_events=args.events, hits_per_event=args.hits,
+                 particles_per_event=args.particles, s2_peaks=args.s2_peaks,
+                 s2_samples=args.s2_samples, sipms_per_peak=args.sipms,
+                 reco_hits_per_sample=args.reco_hits, seed=args.seed)
+    if args.db is not None:
+        make_sensor_db(args.db)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,250 @@
+"""Benchmark suite for the converter, on synthetic fixtures
+
+Generates (once) a synthetic IC file and sensor database with
+make_fixtures, then times:
+
+  - IOManager navigation: go_to_entry in random order, and iter_events
+  - each stage of the event loop (read, mc, pmaps, reco, save), from the
+    converter's own instrumentation
+  - the full conversion
+
+larcv is replaced by the stand-in writer of fake_larcv, so this runs
+without ROOT; --backend hdf5 times the HDF5 writer instead.  Each benchmark is repeated and the best time kept.  The
+results are appended to a JSON history, and compared with the last run
+made with the same fixture parameters: metrics slower than that by more
+than the tolerance are flagged as regressions.
+
+    python benchmarks/run_benchmarks.py --events 500 --repeat 3
+"""
+import os, sys
+import argparse
+import datetime
+import json
+import platform
+import subprocess
+import tempfile
+import time
+
+import numpy
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, '..'))
+sys.path.insert(0, BENCHMARK_DIR)
+
+import fake_larcv
+fake_larcv.install()
+
+import make_fixtures
+import larcv_voxels
+import load_db
+import OutputWriter
+from IOManager import IOManager
+from Converter import Converter
+
+# The compiled bridge would expect real larcv objects:
+larcv_voxels._bridge = False
+
+
+class _Quiet(object):
+    """Silence the converter's stdout while timing it"""
+    def __enter__(self):
+        self._stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+
+    def __exit__(self, *args):
+        sys.stdout.close()
+        sys.stdout = self._stdout
+
+
+def fixture_name(params):
+    return 'fixture_' + '_'.join('{}{}'.format(key, params[key]) for key in sorted(params)) + '.h5'
+
+
+def prepare(work_dir, params):
+    """Create the fixture, database and geometry snapshot if needed
+
+    Returns:
+        tuple -- (ic file, geometry snapshot)
+    """
+    if not os.path.isdir(work_dir):
+        os.makedirs(work_dir)
+
+    # The converter reads the database from its default location:
+    db_file = os.path.join(work_dir, load_db.DATABASE_LOCATION)
+    if not os.path.exists(db_file):
+        make_fixtures.make_sensor_db(db_file)
+
+    snapshot = os.path.join(work_dir, 'geometry.npz')
+    if not os.path.exists(snapshot):
+        load_db.save_snapshot(snapshot, db_file=db_file)
+
+    ic_file = os.path.join(work_dir, fixture_name(params))
+    if not os.path.exists(ic_file):
+        make_fixtures.make_ic_file(ic_file, **params)
+
+    return ic_file, snapshot
+
+
+def bench_navigation(ic_file, seed=0):
+    """Microseconds per entry for random access and for iteration"""
+    io = IOManager()
+    io.set_file(ic_file)
+    n_entries = io.num_events()
+
+    order = numpy.random.RandomState(seed).permutation(n_entries)
+    start = time.time()
+    for entry in order.tolist():
+        io.go_to_entry(entry)
+        io.pmaps().s2Si()
+        io.reco().hits()
+    go_to_entry = time.time() - start
+
+    start = time.time()
+    for record in io.iter_events():
+        pass
+    iter_events = time.time() - start
+    io.close()
+
+    return {
+        'io_go_to_entry_us' : 1e6 * go_to_entry / n_entries,
+        'io_iter_events_us' : 1e6 * iter_events / n_entries,
+    }
+
+
+def bench_conversion(ic_file, snapshot, work_dir, output_backend='larcv'):
+    """Milliseconds per event for each stage and for the whole conversion"""
+    trace  = os.path.join(work_dir, 'trace.json')
+    output = os.path.join(work_dir, 'output' + OutputWriter.output_suffix(output_backend) + '.h5')
+    converter = Converter(geometry_snapshot=snapshot, progress_interval=0,
+                          output_backend=output_backend)
+
+    start = time.time()
+    with _Quiet():
+        converter.convert(ic_file, output, trace_file=trace)
+    elapsed = time.time() - start
+
+    with open(trace) as _trace:
+        events = json.load(_trace)['events']
+    n_events = max(1, len(events))
+
+    metrics = { 'convert_total_ms' : 1e3 * elapsed / n_events }
+    for event in events:
+        for stage, seconds in event['stages'].items():
+            name = 'stage_{}_ms'.format(stage)
+            metrics[name] = metrics.get(name, 0.) + 1e3 * seconds / n_events
+    return metrics
+
+
+def best_of(repeat, function, *args):
+    best = dict()
+    for _ in range(repeat):
+        for name, value in function(*args).items():
+            best[name] = min(value, best.get(name, value))
+    return best
+
+
+def git_commit():
+    try:
+        output = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                         cwd=BENCHMARK_DIR, stderr=open(os.devnull, 'w'))
+        return output.decode().strip()
+    except Exception:
+        return None
+
+
+def load_history(results_file):
+    if not os.path.exists(results_file):
+        return []
+    with open(results_file) as _results:
+        return json.load(_results)['runs']
+
+
+def find_baseline(history, params):
+    for run in reversed(history):
+        if run['params'] == params:
+            return run
+    return None
+
+
+def compare(metrics, baseline, tolerance):
+    """Print the metrics next to the baseline, return the regressed ones"""
+    regressions = []
+    print("{:<24s} {:>12s} {:>12s} {:>8s}".format("metric", "this run", "baseline", "change"))
+    for name in sorted(metrics):
+        value = metrics[name]
+        reference = baseline['metrics'].get(name) if baseline is not None else None
+        if not reference:
+            print("{:<24s} {:12.3f} {:>12s}".format(name, value, "-"))
+            continue
+        change = value / reference - 1.
+        flag = ''
+        if change > tolerance:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print("{:<24s} {:12.3f} {:12.3f} {:+7.1f}%{}".format(name, value, reference, 100. * change, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the converter on synthetic IC files')
+    parser.add_argument('--events', type=int, default=200,
+                        help='integer, Number of events in the fixture (default 200)')
+    parser.add_argument('--hits', type=int, default=200,
+                        help='integer, Mean number of MC hits per event (default 200)')
+    parser.add_argument('--sipms', type=int, default=30,
+                        help='integer, SiPMs per S2 peak (default 30)')
+    parser.add_argument('--s2-samples', type=int, default=15,
+                        help='integer, Mean number of samples per S2 peak (default 15)')
+    parser.add_argument('--backend', default='larcv', choices=['larcv', 'hdf5'],
+                        help='string,  Output backend, larcv is the stand-in writer (default larcv)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='integer, Repetitions, the best time is kept (default 3)')
+    parser.add_argument('--work-dir', default=os.path.join(tempfile.gettempdir(), 'ictolarcv_benchmarks'),
+                        help='string,  Directory for the fixtures (default: in the temporary directory)')
+    parser.add_argument('--results', default=os.path.join(BENCHMARK_DIR, 'results.json'),
+                        help='string,  JSON history of the results (default: benchmarks/results.json)')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='float,   Slowdown flagged as a regression (default 0.2, i.e. 20%%)')
+    parser.add_argument('--no-save', action='store_true', default=False,
+                        help='Compare with the history without adding this run to it')
+    args = parser.parse_args()
+
+    params = dict(n_events=args.events, hits_per_event=args.hits,
+                  sipms_per_peak=args.sipms, s2_samples=args.s2_samples)
+
+    ic_file, snapshot = prepare(args.work_dir, params)
+
+    # Relative database paths are resolved from the work directory:
+    cwd = os.getcwd()
+    os.chdir(args.work_dir)
+    try:
+        metrics = best_of(args.repeat, bench_navigation, ic_file)
+        metrics.update(best_of(args.repeat, bench_conversion, ic_file, snapshot, args.work_dir,
+                               args.backend))
+    finally:
+        os.chdir(cwd)
+
+    # Runs are only compared with runs of the same fixture and backend:
+    params['backend'] = args.backend
+    history  = load_history(args.results)
+    baseline = find_baseline(history, params)
+    regressions = compare(metrics, baseline, args.tolerance)
+
+    if not args.no_save:
+        history.append(dict(
+            date     = datetime.datetime.now().isoformat(),
+            commit   = git_commit(),
+            python   = platform.python_version(),
+            numpy    = numpy.__version__,
+            params   = params,
+            metrics  = metrics))
+        with open(args.results, 'w') as _results:
+            json.dump({'runs' : history}, _results, indent=1, sort_keys=True)
+
+    if regressions:
+        print("{} metric(s) regressed by more than {:.0f}%".format(len(regressions), 100 * args.tolerance))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
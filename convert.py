@@ -2,15 +2,22 @@ import sys, os
 
 import argparse
 from Converter import Converter
+from EventFilter import EventFilter
+from Geometry import Geometry
+from BatchConverter import BatchConverter, ShardedConverter, expand_inputs
 
 def main():
 
 
     parser = argparse.ArgumentParser(description='IC file converter to larcv format')
 
-    parser.add_argument('-i','--input',required=True,
+    parser.add_argument('-i','--input',nargs='+',default=[],
                         dest='ic_fin',
-                        help='Input IC file (Required)')
+                        help='Input IC file(s) or glob pattern(s)')
+
+    parser.add_argument('-m','--manifest',default=None,
+                        type=str, dest='manifest',
+                        help='string,  Text file listing input files, one per line (optional)')
 
     parser.add_argument('-nevents','--num-events',
                         type=int, dest='nevents', default=None,
@@ -18,16 +25,194 @@ def main():
 
     parser.add_argument('-o','--output',default=None,
                         type=str, dest='larcv_fout',
-                        help='string,  Output larcv file name (optional)')
+                        help='string,  Output larcv file name, single input only (optional)')
+
+    parser.add_argument('-d','--output-dir',default=None,
+                        type=str, dest='output_dir',
+                        help='string,  Directory for the outputs of a batch (default: next to each input)')
+
+    parser.add_argument('-j','--jobs',default=1,
+                        type=int, dest='jobs',
+                        help='integer, Number of worker processes for a batch (default 1)')
+
+    parser.add_argument('--shards',default=None,
+                        type=int, dest='shards',
+                        help='integer, Split a single input into this many shards converted in parallel (optional)')
+
+    parser.add_argument('--shard',default=None,
+                        type=int, dest='shard', action='append',
+                        help='integer, Only (re)generate this shard number, can be repeated (optional)')
+
+    parser.add_argument('--merge', action='store_true',
+                        dest='merge', default=False,
+                        help='Merge the shards, or the checkpointed parts, into the output file once they are converted')
+
+    parser.add_argument('--checkpoint',default=None,
+                        type=int, dest='checkpoint',
+                        help='integer, Seal the output in a new part every this many entries; a rerun resumes after the last part, single input only (optional)')
+
+    parser.add_argument('--cache-index', action='store_true',
+                        dest='cache_index', default=False,
+                        help='Save the event index next to the input file and reuse it on later runs')
+
+    parser.add_argument('--geometry-snapshot',default=None,
+                        type=str, dest='geometry_snapshot',
+                        help='string,  .npz snapshot of the sensor tables, created from the database if missing (optional)')
+
+    parser.add_argument('--geometry-config',default=None,
+                        type=str, dest='geometry_config',
+                        help='string,  JSON file of voxel grids (resolution, bounds, padding and the products among mc, pmaps, reco voxelized on it, or coarsen and factor for coarser copies of the products) added to the default mc and pmaps grids (optional)')
+
+    parser.add_argument('--drop-inactive', action='store_true',
+                        dest='drop_inactive', default=False,
+                        help='Drop the PMaps samples of masked (inactive) sensors')
+
+    parser.add_argument('--streaming', action='store_true',
+                        dest='streaming', default=False,
+                        help='Read the input in large blocks, prefetched in a background thread')
+
+    parser.add_argument('--read-ahead',default=2,
+                        type=int, dest='read_ahead',
+                        help='integer, Number of blocks read ahead in streaming mode (default 2)')
+
+    parser.add_argument('--memory-budget',default=256,
+                        type=int, dest='memory_budget',
+                        help='integer, MB of input blocks held in streaming mode (default 256)')
+
+    parser.add_argument('--backend',default='larcv',
+                        choices=['larcv', 'hdf5'], dest='backend',
+                        help='string,  Output format: larcv, or flat hdf5 tables that need no larcv (default larcv)')
+
+    parser.add_argument('--products',nargs='+',default=None,
+                        choices=['mc', 'pmaps', 'reco'], dest='products',
+                        help='Products to convert, any of mc, pmaps and reco (default: all)')
+
+    parser.add_argument('--event-list',default=None,
+                        type=str, dest='event_list',
+                        help='string,  Only convert the event numbers listed in this file (optional)')
+
+    parser.add_argument('--runs',nargs='+',default=None,
+                        type=int, dest='runs',
+                        help='Only convert events of these runs (optional)')
+
+    parser.add_argument('--require-s1', action='store_true',
+                        dest='require_s1', default=False,
+                        help='Only convert events with an S1')
+
+    parser.add_argument('--min-s2-peaks',default=None,
+                        type=int, dest='min_s2_peaks',
+                        help='integer, Only convert events with at least this many S2 peaks (optional)')
+
+    parser.add_argument('--max-s2-peaks',default=None,
+                        type=int, dest='max_s2_peaks',
+                        help='integer, Only convert events with at most this many S2 peaks (optional)')
+
+    parser.add_argument('--s2-energy',nargs=2,default=None,
+                        type=float, dest='s2_energy', metavar=('MIN', 'MAX'),
+                        help='float,   Only convert events with a total S2 energy in [MIN, MAX] (optional)')
+
+    parser.add_argument('--async-write', action='store_true',
+                        dest='async_write', default=False,
+                        help='Write the output on a background thread while the next events are converted')
+
+    parser.add_argument('--write-queue',default=8,
+                        type=int, dest='write_queue',
+                        help='integer, Entries waiting to be written before conversion blocks, with --async-write (default 8)')
+
+    parser.add_argument('--progress',default=100,
+                        type=int, dest='progress',
+                        help='integer, Print progress every this many entries, 0 to disable (default 100)')
+
+    parser.add_argument('--trace',default=None,
+                        type=str, dest='trace',
+                        help='string,  Write per event stage timings to this file, .csv or .json, single input only (optional)')
 
     args = parser.parse_args()
 
+    io_options = dict(cache_index   = args.cache_index,
+                      streaming     = args.streaming,
+                      read_ahead    = args.read_ahead,
+                      memory_budget = args.memory_budget * 1024**2)
+
+    event_filter = None
+    if args.event_list is not None or args.runs is not None or args.require_s1 \
+            or args.min_s2_peaks is not None or args.max_s2_peaks is not None \
+            or args.s2_energy is not None:
+        event_filter = EventFilter(
+            events       = EventFilter.read_event_list(args.event_list) if args.event_list else None,
+            runs         = args.runs,
+            require_s1   = args.require_s1,
+            min_s2_peaks = args.min_s2_peaks,
+            max_s2_peaks = args.max_s2_peaks,
+            s2_energy    = args.s2_energy)
+
+    converter_options = dict(geometry_snapshot = args.geometry_snapshot,
+                             drop_inactive     = args.drop_inactive,
+                             progress_interval = args.progress,
+                             output_backend    = args.backend,
+                             async_write       = args.async_write,
+                             write_queue       = args.write_queue,
+                             products          = args.products,
+                             event_filter      = event_filter,
+                             geometry_config   = Geometry.read_config(args.geometry_config)
+                                                 if args.geometry_config else None)
+
+    if not args.ic_fin and args.manifest is None:
+        parser.error('at least one input (-i) or a manifest (-m) is required')
 
+    # Glob patterns and manifests are expanded before deciding between a
+    # single conversion and a batch:
+    files = expand_inputs(args.ic_fin, args.manifest)
+    if not files:
+        parser.error('no input files found')
 
-    c = Converter()
-    c.convert(_file_in = args.ic_fin, _file_out=args.larcv_fout, max_entries=args.nevents)
+    if args.shard is not None and args.shards is None:
+        parser.error('--shard needs --shards')
+
+    if args.shards is not None:
+        if args.shards < 1:
+            parser.error('--shards needs at least one shard')
+        if args.shard is not None and any(not 0 <= i < args.shards for i in args.shard):
+            parser.error('--shard numbers go from 0 to {}'.format(args.shards - 1))
+        if len(files) != 1:
+            parser.error('--shards applies to a single input file')
+        if args.trace is not None:
+            parser.error('--trace does not apply to sharded conversions')
+        if args.checkpoint is not None:
+            parser.error('--checkpoint does not apply to sharded conversions')
+        s = ShardedConverter(args.shards, jobs=args.jobs if args.jobs > 1 else None,
+                             max_entries=args.nevents, converter_options=converter_options,
+                             **io_options)
+        failures = s.run(files[0], args.larcv_fout, only=args.shard, merge=args.merge)
+        if failures:
+            sys.exit(1)
+        return
+
+    batch = len(files) > 1 or args.jobs > 1 or args.output_dir is not None
+
+    if not batch:
+        c = Converter(**converter_options)
+        c.convert(_file_in = files[0], _file_out=args.larcv_fout, max_entries=args.nevents,
+                  trace_file=args.trace, checkpoint=args.checkpoint, merge=args.merge,
+                  **io_options)
+        return
+
+    if args.trace is not None:
+        parser.error('--trace only applies to a single input')
+
+    if args.checkpoint is not None:
+        parser.error('--checkpoint only applies to a single input')
+
+    if args.larcv_fout is not None:
+        parser.error('--output only applies to a single input, use --output-dir for a batch')
+
+    b = BatchConverter(jobs=args.jobs, output_dir=args.output_dir, max_entries=args.nevents,
+                       converter_options=converter_options, **io_options)
+    failures = b.run(files)
+
+    if failures:
+        sys.exit(1)
 
 
 if __name__ == '__main__':
     main()
-
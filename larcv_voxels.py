@@ -0,0 +1,97 @@
+import numpy
+
+from larcv import larcv
+import voxelize
+
+
+# Loop over the voxels on the C++ side, compiled once by cling on first use.
+# SparseTensor3D is a VoxelSet, so this fills both tensors and cluster sets.
+_BRIDGE_CODE = '''
+namespace ictolarcv {
+void fill_voxel_set(larcv::VoxelSet& voxels, const std::size_t* ids,
+                    const float* values, std::size_t n) {
+    for (std::size_t i = 0; i < n; ++i) voxels.add(larcv::Voxel(ids[i], values[i]));
+}
+}
+'''
+
+# None: not tried yet, False: not available, otherwise the compiled function
+_bridge = None
+
+def _native_fill():
+    global _bridge
+    if _bridge is None:
+        try:
+            import ROOT
+            if not ROOT.gInterpreter.Declare(_BRIDGE_CODE):
+                raise RuntimeError("Could not compile the voxel fill bridge")
+            _bridge = ROOT.ictolarcv.fill_voxel_set
+        except Exception:
+            _bridge = False
+    return _bridge
+
+
+def native_available():
+    """Whether voxels are filled through the compiled bridge"""
+    return bool(_native_fill())
+
+
+def fill_voxel_set(voxel_set, index, values, aggregated=False):
+    """Add many voxels to a larcv VoxelSet or SparseTensor3D at once
+
+    The voxels cross into C++ in a single call through a small bridge
+    compiled with ROOT's interpreter.  If that isn't available, they are
+    added one by one from python.
+
+    Arguments:
+        voxel_set {larcv.VoxelSet} -- set to fill, voxels with the same index are summed
+        index {numpy.ndarray} -- voxel index of each value
+        values {numpy.ndarray} -- voxel values
+
+    Keyword Arguments:
+        aggregated {bool} -- index is already sorted and unique (default: {False})
+
+    Returns:
+        int -- number of distinct voxels added
+    """
+    if not aggregated:
+        index, values = voxelize.sum_duplicates(index, values)
+
+    ids    = numpy.ascontiguousarray(index,  dtype=numpy.uintp)
+    values = numpy.ascontiguousarray(values, dtype=numpy.float32)
+    if len(ids) == 0:
+        return 0
+
+    bridge = _native_fill()
+    if bridge:
+        bridge(voxel_set, ids, values, len(ids))
+    else:
+        for voxel_id, value in zip(ids.tolist(), values.tolist()):
+            voxel_set.add(larcv.Voxel(voxel_id, value))
+    return len(ids)
+
+
+def fill_clusters(sparse_cluster, cluster, index, values, aggregated=False):
+    """Fill the voxel sets of a SparseCluster3D, summing voxels per cluster
+
+    Arguments:
+        sparse_cluster {larcv.SparseCluster3D} -- clusters to fill, already resized
+        cluster {numpy.ndarray} -- cluster number of each value
+        index {numpy.ndarray} -- voxel index of each value
+        values {numpy.ndarray} -- voxel values
+
+    Keyword Arguments:
+        aggregated {bool} -- already summed and sorted by cluster then index,
+                             see voxelize.sum_by_cluster (default: {False})
+    """
+    if not aggregated:
+        cluster, index, values = voxelize.sum_by_cluster(cluster, index, values)
+
+    # Each cluster is a contiguous block:
+    starts = numpy.flatnonzero(numpy.diff(cluster)) + 1
+    first  = numpy.concatenate(([0], starts))[:len(cluster)]
+    for idx, voxel_ids, voxel_values in zip(numpy.asarray(cluster)[first].tolist(),
+                                            numpy.split(index, starts),
+                                            numpy.split(values, starts)):
+        fill_voxel_set(sparse_cluster.writeable_voxel_set(idx), voxel_ids, voxel_values,
+                       aggregated=True)
@@ -1,9 +1,8 @@
 import sqlite3
 import numpy as np
-import pandas as pd
 import os
-from operator  import itemgetter
-# from functools import lru_cache
+import inspect
+import numbers
 
 DATABASE_LOCATION =  'localdb.sqlite3'
 
@@ -11,12 +10,79 @@ DATABASE_LOCATION =  'localdb.sqlite3'
 def tmap(*args):
     return tuple(map(*args))
 
+
+def _memoize(function):
+    '''Cache the result of a query per arguments and database version
+
+    A replacement for functools.lru_cache that also works on python 2.  The
+    modification time of db_file is part of the key, so an updated database
+    is queried again.  Cached results are shared between callers and should
+    not be modified.
+    '''
+    cache = dict()
+
+    def wrapper(*args, **kwargs):
+        call_args = inspect.getcallargs(function, *args, **kwargs)
+        db_file = call_args['db_file']
+        mtime = os.path.getmtime(db_file) if os.path.exists(db_file) else None
+
+        key = (tuple(sorted(call_args.items())), mtime)
+        if key not in cache:
+            cache[key] = function(*args, **kwargs)
+        return cache[key]
+
+    wrapper.__name__  = function.__name__
+    wrapper.__doc__   = function.__doc__
+    wrapper.cache     = cache
+    return wrapper
+
+def _column(values, fillna=None):
+    '''Turn the values of one sqlite result column into a numpy array
+
+    Integer columns stay integers unless they have NULLs, which become NaN
+    (or fillna) like they do in pandas.  Text columns become strings.
+    '''
+    if fillna is not None:
+        values = [ fillna if v is None else v for v in values ]
+
+    present = [ v for v in values if v is not None ]
+    if any(not isinstance(v, numbers.Number) for v in present):
+        return np.array([ '' if v is None else v for v in values ]).astype(str)
+    if len(present) == len(values) and all(isinstance(v, numbers.Integral) for v in present):
+        return np.array(values, dtype=np.int64)
+    return np.array([ np.nan if v is None else v for v in values ], dtype=np.float64)
+
+
+def _read_sql(sql, conn, backend='pandas', fillna=None):
+    '''Run a query and return the result as a table
+
+    The pandas backend returns a DataFrame.  The numpy backend returns a
+    numpy record array with the same column names, read straight from the
+    sqlite cursor, and never imports pandas.
+    '''
+    if backend == 'pandas':
+        import pandas as pd
+        data = pd.read_sql_query(sql, conn)
+        if fillna is not None:
+            data.fillna(fillna, inplace=True)
+        return data
+
+    if backend != 'numpy':
+        raise ValueError("Unknown database backend {}".format(backend))
+
+    cursor  = conn.execute(sql)
+    names   = [ str(description[0]) for description in cursor.description ]
+    rows    = cursor.fetchall()
+    columns = list(zip(*rows)) if rows else [ () for name in names ]
+    return np.rec.fromarrays([ _column(c, fillna) for c in columns ], names=names)
+
+
 # Run to take always the same calibration constant, etc for MC files
 # 3012 was the first SiPM calibration after remapping.
 runNumberForMC = 3012
 
-# @lru_cache(maxsize=10)
-def DataPMT(run_number=1e5, db_file=DATABASE_LOCATION):
+@_memoize
+def DataPMT(run_number=1e5, db_file=DATABASE_LOCATION, backend='pandas'):
     if run_number == 0:
         run_number = runNumberForMC
 
@@ -42,13 +108,12 @@ and map.MinRun <= {0} and {0} <= map.MaxRun
 and pos.Label LIKE 'PMT%'
 order by Active desc, pos.SensorID
 '''.format(abs(run_number))
-    data = pd.read_sql_query(sql, conn)
-    data.fillna(0, inplace=True)
+    data = _read_sql(sql, conn, backend, fillna=0)
     conn.close()
     return data
 
-# @lru_cache(maxsize=10)
-def DataSiPM(run_number=1e5, db_file=DATABASE_LOCATION):
+@_memoize
+def DataSiPM(run_number=1e5, db_file=DATABASE_LOCATION, backend='pandas'):
     if run_number == 0:
         run_number = runNumberForMC
 
@@ -67,25 +132,47 @@ and pos.MinRun <= {0} and {0} <= pos.MaxRun
 and gain.MinRun <= {0} and {0} <= gain.MaxRun
 and map.MinRun <= {0} and {0} <= map.MaxRun
 order by pos.SensorID'''.format(abs(run_number))
-    data = pd.read_sql_query(sql, conn)
+    data = _read_sql(sql, conn, backend)
     conn.close()
 
     ## Add default value to Sigma for runs without measurement
-    if not data.Sigma.values.any():
+    if backend == 'pandas':
+        if not data.Sigma.values.any():
+            data.Sigma = 2.24
+    elif not np.nan_to_num(data.Sigma).any():
         data.Sigma = 2.24
 
     return data
 
-# @lru_cache(maxsize=10)
-def DetectorGeo(db_file=DATABASE_LOCATION):
+@_memoize
+def DetectorGeo(db_file=DATABASE_LOCATION, backend='pandas'):
     conn = sqlite3.connect(db_file)
     sql = 'select * from DetectorGeo'
-    data = pd.read_sql_query(sql, conn)
+    data = _read_sql(sql, conn, backend)
     conn.close()
     return data
 
-# @lru_cache(maxsize=10)
-def SiPMNoise(run_number=1e5, db_file=DATABASE_LOCATION):
+@_memoize
+def SiPMNoise(run_number=1e5, db_file=DATABASE_LOCATION, cache_file=None, chunk_size=65536):
+    '''Noise PDF of every SiPM
+
+    The probabilities are read from the cursor in chunks of chunk_size rows
+    straight into a preallocated float32 (nsipms, nbins) array, so the peak
+    memory stays close to the size of the result.  With cache_file, the
+    result is also saved to (and later loaded from) that .npz file, as long
+    as it was made for the same run and database.
+
+    Returns:
+        tuple -- (noise, noise_bins, baselines)
+    '''
+    db_mtime = os.path.getmtime(db_file) if os.path.exists(db_file) else 0
+    source = (float(run_number), float(db_mtime))
+
+    if cache_file is not None and os.path.exists(cache_file):
+        with np.load(cache_file) as cached:
+            if tuple(cached['source']) == source:
+                return cached['noise'], cached['noise_bins'], cached['baselines']
+
     conn = sqlite3.connect(db_file)
     cursor = conn.cursor()
 
@@ -93,21 +180,109 @@ def SiPMNoise(run_number=1e5, db_file=DATABASE_LOCATION):
 where MinRun <= {0} and (MaxRun >= {0} or MaxRun is NULL)
 order by SensorID;'''.format(abs(run_number))
     cursor.execute(sqlbaseline)
-    baselines = np.array(tmap(itemgetter(0), cursor.fetchall()))
+    baselines = np.fromiter((row[0] for row in cursor), dtype=np.float64)
     nsipms = baselines.shape[0]
 
     sqlnoisebins = '''select distinct(BinEnergyPes) from SipmNoisePDF
 where MinRun <= {0} and (MaxRun >= {0} or MaxRun is NULL)
 order by BinEnergyPes;'''.format(abs(run_number))
     cursor.execute(sqlnoisebins)
-    noise_bins = np.array(tmap(itemgetter(0), cursor.fetchall()))
+    noise_bins = np.fromiter((row[0] for row in cursor), dtype=np.float64)
     nbins = noise_bins.shape[0]
 
     sqlnoise = '''select Probability from SipmNoisePDF
 where MinRun <= {0} and (MaxRun >= {0} or MaxRun is NULL)
 order by SensorID, BinEnergyPes;'''.format(abs(run_number))
     cursor.execute(sqlnoise)
-    data = tmap(itemgetter(0), cursor.fetchall())
-    noise = np.array(data).reshape(nsipms, nbins)
+
+    noise = np.empty((nsipms, nbins), dtype=np.float32)
+    flat  = noise.reshape(-1)
+    filled = 0
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        if filled + len(rows) > flat.size:
+            raise Exception("SiPM noise table has more entries than {} sipms x {} bins".format(
+                nsipms, nbins))
+        flat[filled:filled + len(rows)] = np.fromiter(
+            (row[0] for row in rows), dtype=np.float32, count=len(rows))
+        filled += len(rows)
+    conn.close()
+
+    if filled != flat.size:
+        raise Exception("SiPM noise table has {} entries, expected {} sipms x {} bins".format(
+            filled, nsipms, nbins))
+
+    if cache_file is not None:
+        np.savez(cache_file, source=np.array(source), noise=noise,
+                 noise_bins=noise_bins, baselines=baselines)
 
     return noise, noise_bins, baselines
+
+
+def _to_records(data):
+    '''DataFrame to a record array, with text columns stored as fixed width strings'''
+    if isinstance(data, np.recarray):
+        return data
+
+    columns = []
+    for name in data.columns:
+        values = np.asarray(data[name])
+        if values.dtype.kind == 'O':
+            values = values.astype(str)
+        columns.append(values)
+    return np.rec.fromarrays(columns, names=[str(name) for name in data.columns])
+
+
+def save_snapshot(snapshot_file, run_number=1e5, db_file=DATABASE_LOCATION, backend='numpy'):
+    '''Save the PMT, SiPM and detector geometry tables of a run to a .npz file
+
+    The snapshot can be loaded with load_snapshot without sqlite or pandas.
+    '''
+    db_mtime = os.path.getmtime(db_file) if os.path.exists(db_file) else 0
+    np.savez(snapshot_file,
+             source = np.array([run_number, db_mtime], dtype=np.float64),
+             pmt  = _to_records(DataPMT(run_number, db_file, backend)),
+             sipm = _to_records(DataSiPM(run_number, db_file, backend)),
+             geo  = _to_records(DetectorGeo(db_file, backend)))
+
+
+def load_snapshot(snapshot_file):
+    '''Load a snapshot written by save_snapshot
+
+    Returns:
+        tuple -- (pmt, sipm, geo) record arrays, with the columns of
+                 DataPMT, DataSiPM and DetectorGeo as attributes
+    '''
+    with np.load(snapshot_file) as snapshot:
+        return tuple(snapshot[name].view(np.recarray) for name in ('pmt', 'sipm', 'geo'))
+
+
+def SensorTables(run_number=1e5, db_file=DATABASE_LOCATION, snapshot_file=None, backend='pandas'):
+    '''PMT, SiPM and detector geometry tables, from a snapshot when possible
+
+    Queries go through the given backend, see _read_sql.
+
+    If snapshot_file is given but doesn't exist yet, or was made for another
+    run or an older database, it is (re)created from the database first.
+    Without a database, an existing snapshot is used as is.
+
+    Returns:
+        tuple -- (pmt, sipm, geo)
+    '''
+    if snapshot_file is None:
+        return (DataPMT(run_number, db_file, backend),
+                DataSiPM(run_number, db_file, backend),
+                DetectorGeo(db_file, backend))
+
+    if os.path.exists(snapshot_file):
+        if not os.path.exists(db_file):
+            return load_snapshot(snapshot_file)
+        with np.load(snapshot_file) as snapshot:
+            source = tuple(snapshot['source'])
+        if source == (run_number, os.path.getmtime(db_file)):
+            return load_snapshot(snapshot_file)
+
+    save_snapshot(snapshot_file, run_number, db_file, backend)
+    return load_snapshot(snapshot_file)
@@ -0,0 +1,127 @@
+import numpy
+
+from BufferPool import BufferPool
+
+
+def sum_duplicates(index, *values):
+    """Merge entries that share an index, summing their values
+
+    Several value arrays can be given; they are all summed over the same
+    unique index, which is only computed once.
+
+    Arguments:
+        index {numpy.ndarray} -- integer index of each entry
+        values {numpy.ndarray} -- value of each entry, one or more arrays
+
+    Returns:
+        tuple -- (unique index, summed values, ...), sorted by index
+    """
+    unique_index, inverse = numpy.unique(index, return_inverse=True)
+    inverse = inverse.ravel()
+    return (unique_index,) + tuple(
+        numpy.bincount(inverse, weights=value, minlength=len(unique_index))
+        for value in values)
+
+
+def sum_by_cluster(cluster, index, values):
+    """Merge entries that share a cluster and an index, summing their values
+
+    Arguments:
+        cluster {numpy.ndarray} -- non negative cluster number of each entry
+        index {numpy.ndarray} -- non negative integer index of each entry
+        values {numpy.ndarray} -- value of each entry
+
+    Returns:
+        tuple -- (cluster, index, summed values), sorted by cluster then index
+    """
+    cluster = numpy.asarray(cluster, dtype=numpy.int64)
+    index   = numpy.asarray(index,   dtype=numpy.int64)
+
+    # A single key sorting by cluster first:
+    n_index = int(index.max()) + 1 if len(index) else 1
+    key, summed = sum_duplicates(cluster * n_index + index, values)
+    cluster, index = numpy.divmod(key, n_index)
+    return cluster, index, summed
+
+
+def group_rank(keys, buffers=None):
+    """Position of each row among the previous rows sharing the same keys
+
+    This is a grouped cumulative count: the first row of every combination
+    of keys gets 0, the second 1 and so on, in the original row order.
+
+    Arguments:
+        keys {tuple} -- one or more numpy.ndarray of the same length
+
+    Keyword Arguments:
+        buffers {BufferPool} -- scratch arrays to reuse (default: {None}, allocate)
+
+    Returns:
+        numpy.ndarray -- int64 rank of each row within its group; with
+                         buffers, only valid until the next call
+    """
+    if buffers is None:
+        buffers = BufferPool(reuse=False)
+
+    n = len(keys[0])
+    rank = buffers.array('group_rank/rank', n, numpy.int64)
+    if n == 0:
+        return rank
+
+    # lexsort is stable, so rows of a group stay in their original order:
+    order = numpy.lexsort(keys[::-1])
+
+    new_group = buffers.array('group_rank/new_group', n, bool)
+    changed   = buffers.array('group_rank/changed',   n, bool)
+    new_group[0] = True
+    new_group[1:] = False
+    for key in keys:
+        key = numpy.asarray(key)
+        sorted_key = numpy.take(key, order, out=buffers.array('group_rank/' + key.dtype.str, n, key.dtype))
+        new_group[1:] |= numpy.not_equal(sorted_key[1:], sorted_key[:-1], out=changed[1:])
+
+    # 0, 1, ... n - 1, and the position of the first row of each group:
+    positions = buffers.array('group_rank/positions', n, numpy.int64)
+    positions.fill(1)
+    positions[0] = 0
+    numpy.cumsum(positions, out=positions)
+    group_start = numpy.multiply(new_group, positions, out=buffers.array('group_rank/start', n, numpy.int64))
+    numpy.maximum.accumulate(group_start, out=group_start)
+
+    rank[order] = numpy.subtract(positions, group_start, out=group_start)
+    return rank
+
+
+def map_ids(keys, values, queries, default):
+    """Vectorized dictionary lookup
+
+    Equivalent to [dict(zip(keys, values)).get(q, default) for q in queries],
+    where later keys take precedence over earlier duplicates like in a dict.
+
+    Arguments:
+        keys {numpy.ndarray} -- lookup keys
+        values {numpy.ndarray} -- value of each key
+        queries {numpy.ndarray} -- keys to look up
+        default -- value of queries not found in keys
+
+    Returns:
+        numpy.ndarray -- the value of each query
+    """
+    keys    = numpy.asarray(keys)
+    values  = numpy.asarray(values)
+    queries = numpy.asarray(queries)
+
+    result = numpy.full(len(queries), default, dtype=numpy.int64)
+    if len(keys) == 0 or len(queries) == 0:
+        return result
+
+    order = numpy.argsort(keys, kind='mergesort')
+    sorted_keys = keys[order]
+
+    # The last of any duplicated keys wins, as it would in a dict:
+    position = numpy.searchsorted(sorted_keys, queries, side='right') - 1
+    found = position >= 0
+    found[found] = sorted_keys[position[found]] == queries[found]
+
+    result[found] = values[order[position[found]]]
+    return result